@@ -0,0 +1,49 @@
+"""
+Compares utilities.isoparse with utilities.strptime on the timestamps
+the addon parses most: DataPoint's dataDate and the cache's expiry.
+
+    python benchmarks/bench_isoparse.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+
+from metoffice import utilities  # noqa: E402
+from metoffice.constants import DATAPOINT_DATETIME_FORMAT  # noqa: E402
+from metoffice.urlcache import URLCache  # noqa: E402
+
+NUMBER = 100000
+
+CASES = [
+    (
+        "dataDate",
+        lambda: utilities.strptime("2014-02-04T11:00:00", DATAPOINT_DATETIME_FORMAT),
+        lambda: utilities.isoparse("2014-02-04T11:00:00Z"),
+    ),
+    (
+        "expiry",
+        lambda: utilities.strptime("2014-02-04T12:30:00Z", URLCache.TIME_FORMAT),
+        lambda: utilities.isoparse("2014-02-04T12:30:00Z"),
+    ),
+]
+
+
+def main():
+    for name, old, new in CASES:
+        before = min(timeit.repeat(old, number=NUMBER, repeat=5))
+        after = min(timeit.repeat(new, number=NUMBER, repeat=5))
+        print(
+            "{0:10} strptime {1:6.2f}us  isoparse {2:6.2f}us  {3:5.1f}x".format(
+                name,
+                before / NUMBER * 1e6,
+                after / NUMBER * 1e6,
+                before / after,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Times properties.threehourly and properties.daily on the five day
+forecasts in test/data, and the formatting of their dates the way it
+was done before: parsed and formatted again for every Rep.
+
+    python benchmarks/bench_properties.py
+"""
+
+import json
+import os
+import sys
+import time
+import timeit
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+
+from metoffice import properties, utilities  # noqa: E402
+from metoffice.constants import (  # noqa: E402
+    DATAPOINT_DATE_FORMAT,
+    SHORT_DATE_FORMAT,
+)
+
+DATA_FOLDER = os.path.join(os.path.dirname(__file__), os.pardir, "test", "data")
+NUMBER = 1000
+
+
+def load(name):
+    with open(os.path.join(DATA_FOLDER, name)) as fh:
+        return json.load(fh)
+
+
+class Window(dict):
+    setProperty = dict.__setitem__
+
+
+def per_rep(data):
+    # How Hourly.%d.ShortDate was produced before.
+    for period in data["SiteRep"]["DV"]["Location"]["Period"]:
+        for rep in period["Rep"]:
+            time.strftime(
+                SHORT_DATE_FORMAT,
+                time.strptime(period.get("value"), DATAPOINT_DATE_FORMAT),
+            )
+
+
+def per_period(data):
+    for period in data["SiteRep"]["DV"]["Location"]["Period"]:
+        short_date = properties.short_date(period.get("value"))
+        for rep in period["Rep"]:
+            short_date
+
+
+def report(name, seconds):
+    print("{0:24} {1:8.1f}us".format(name, seconds / NUMBER * 1e6))
+
+
+def main():
+    threehourly = load("forecast3hourly.json")
+    daily = load("forecastdaily.json")
+    for name, func in (("dates per rep", per_rep), ("dates per period", per_period)):
+        report(name, min(timeit.repeat(lambda: func(threehourly), number=NUMBER)))
+    # Kodi's stubs don't say which temperature unit is in use.
+    with patch.object(properties, "window", Window()), patch.object(
+        properties, "TEMPERATUREUNITS", "\u00b0C"
+    ), patch.object(utilities, "TEMPERATUREUNITS", "\u00b0C"):
+        report(
+            "threehourly",
+            min(
+                timeit.repeat(
+                    lambda: properties.threehourly(threehourly), number=NUMBER
+                )
+            ),
+        )
+        report(
+            "daily",
+            min(timeit.repeat(lambda: properties.daily(daily), number=NUMBER)),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Compares setting the daily and 3 hourly rep properties through a
+Forecast and the PropertyMap tables in properties with the hand-written
+loops they replaced, on the five day forecasts in test/data.
+
+    python benchmarks/bench_propertymap.py
+"""
+
+import json
+import os
+import sys
+import timeit
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+
+from metoffice import properties, utilities  # noqa: E402
+from metoffice.constants import (  # noqa: E402
+    SHORT_DATE_FORMAT,
+    SHORT_DAY_FORMAT,
+    WEATHER_CODES,
+)
+from metoffice.forecast import Forecast  # noqa: E402
+
+DATA_FOLDER = os.path.join(os.path.dirname(__file__), os.pardir, "test", "data")
+NUMBER = 1000
+UNITS = "\u00b0C"
+
+
+def load(name):
+    with open(os.path.join(DATA_FOLDER, name)) as fh:
+        return json.load(fh)
+
+
+class Window(dict):
+    setProperty = dict.__setitem__
+
+
+def handwritten_daily(window, data):
+    dv = data["SiteRep"]["DV"]
+    for p, period in enumerate(dv["Location"]["Period"]):
+        date = utilities.isoparse(period.get("value"))
+        short_day = date.strftime(SHORT_DAY_FORMAT)
+        window.setProperty("Day%d.Title" % p, short_day)
+        window.setProperty("Daily.%d.ShortDay" % (p + 1), short_day)
+        window.setProperty(
+            "Daily.%d.ShortDate" % (p + 1),
+            date.strftime(SHORT_DATE_FORMAT),
+        )
+        for rep in period["Rep"]:
+            weather_type = rep.get("W", "na")
+            if rep.get("$") == "Day":
+                window.setProperty("Day%d.HighTemp" % p, rep.get("Dm", "na"))
+                window.setProperty("Day%d.HighTempIcon" % p, rep.get("Dm"))
+                window.setProperty(
+                    "Day%d.Outlook" % p, WEATHER_CODES.get(weather_type)[1]
+                )
+                window.setProperty(
+                    "Day%d.OutlookIcon" % p,
+                    "%s.png" % WEATHER_CODES.get(weather_type, "na")[0],
+                )
+                window.setProperty("Day%d.WindSpeed" % p, rep.get("S", "na"))
+                window.setProperty(
+                    "Day%d.WindDirection" % p, rep.get("D", "na").lower()
+                )
+                window.setProperty(
+                    "Daily.%d.HighTemperature" % (p + 1),
+                    utilities.localised_temperature(rep.get("Dm", "na")) + UNITS,
+                )
+                window.setProperty("Daily.%d.HighTempIcon" % (p + 1), rep.get("Dm"))
+                window.setProperty(
+                    "Daily.%d.Outlook" % (p + 1), WEATHER_CODES.get(weather_type)[1]
+                )
+                window.setProperty(
+                    "Daily.%d.OutlookIcon" % (p + 1),
+                    "%s.png" % WEATHER_CODES.get(weather_type, "na")[0],
+                )
+                window.setProperty(
+                    "Daily.%d.FanartCode" % (p + 1),
+                    WEATHER_CODES.get(weather_type, "na")[0],
+                )
+                window.setProperty("Daily.%d.WindSpeed" % (p + 1), rep.get("S", "na"))
+                window.setProperty(
+                    "Daily.%d.WindDirection" % (p + 1), rep.get("D", "na").lower()
+                )
+            elif rep.get("$") == "Night":
+                window.setProperty("Day%d.LowTemp" % p, rep.get("Nm", "na"))
+                window.setProperty("Day%d.LowTempIcon" % p, rep.get("Nm"))
+                window.setProperty(
+                    "Daily.%d.LowTemperature" % (p + 1),
+                    utilities.localised_temperature(rep.get("Nm", "na")) + UNITS,
+                )
+                window.setProperty("Daily.%d.LowTempIcon" % (p + 1), rep.get("Nm"))
+
+
+def handwritten_threehourly(window, data):
+    dv = data["SiteRep"]["DV"]
+    count = 1
+    for period in dv["Location"]["Period"]:
+        short_date = utilities.isoparse(period.get("value")).strftime(SHORT_DATE_FORMAT)
+        for rep in period["Rep"]:
+            weather_type = rep.get("W", "na")
+            window.setProperty(
+                "Hourly.%d.Outlook" % count, WEATHER_CODES.get(weather_type)[1]
+            )
+            window.setProperty("Hourly.%d.WindSpeed" % count, rep.get("S", "n/a"))
+            window.setProperty(
+                "Hourly.%d.WindDirection" % count, rep.get("D", "na").lower()
+            )
+            window.setProperty("Hourly.%d.GustSpeed" % count, rep.get("G", "n/a"))
+            window.setProperty("Hourly.%d.UVIndex" % count, rep.get("U", "n/a"))
+            window.setProperty("Hourly.%d.Precipitation" % count, rep.get("Pp") + "%")
+            window.setProperty(
+                "Hourly.%d.OutlookIcon" % count,
+                "%s.png" % WEATHER_CODES.get(weather_type, "na")[0],
+            )
+            window.setProperty("Hourly.%d.ShortDate" % count, short_date)
+            window.setProperty(
+                "Hourly.%d.Time" % count, utilities.minutes_as_time(int(rep.get("$")))
+            )
+            window.setProperty(
+                "Hourly.%d.Temperature" % count,
+                utilities.rownd(utilities.localised_temperature(rep.get("T", "na")))
+                + UNITS,
+            )
+            window.setProperty("Hourly.%d.ActualTempIcon" % count, rep.get("T", "na"))
+            window.setProperty(
+                "Hourly.%d.FeelsLikeTemp" % count,
+                utilities.rownd(utilities.localised_temperature(rep.get("F", "na"))),
+            )
+            window.setProperty(
+                "Hourly.%d.FeelsLikeTempIcon" % count, rep.get("F", "na")
+            )
+            count += 1
+
+
+def mapped_daily(window, data):
+    forecast = Forecast.from_json(data, properties.DAILY_FIELDS)
+    for p, date in enumerate(forecast.dates):
+        properties.DAILY_PERIOD.apply(window, {"value": date}, p)
+    for name, mapping in properties.DAILY_REP.items():
+        rows = forecast.rows("$", name)
+        periods = forecast.periods(rows)
+        mapping.apply_rows(window, forecast, rows, periods)
+
+
+def mapped_threehourly(window, data):
+    forecast = Forecast.from_json(data, properties.THREEHOURLY_FIELDS)
+    properties.THREEHOURLY.apply_rows(window, forecast, range(len(forecast)))
+
+
+def main():
+    cases = [
+        ("daily", load("forecastdaily.json"), handwritten_daily, mapped_daily),
+        (
+            "threehourly",
+            load("forecast3hourly.json"),
+            handwritten_threehourly,
+            mapped_threehourly,
+        ),
+    ]
+    with patch.object(properties, "TEMPERATUREUNITS", UNITS), patch.object(
+        utilities, "TEMPERATUREUNITS", UNITS
+    ):
+        for name, data, handwritten, mapped in cases:
+            before, after = Window(), Window()
+            handwritten(before, data)
+            mapped(after, data)
+            assert before == after, name
+            times = [
+                min(timeit.repeat(lambda: func(Window(), data), number=NUMBER))
+                for func in (handwritten, mapped)
+            ]
+            print(
+                "{0:12} hand-written {1:7.1f}us  mapped {2:7.1f}us  {3:4.2f}x".format(
+                    name,
+                    times[0] / NUMBER * 1e6,
+                    times[1] / NUMBER * 1e6,
+                    times[0] / times[1],
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
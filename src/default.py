@@ -17,6 +17,7 @@
 import socket
 import sys
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from urllib.error import HTTPError
 
 import xbmc
@@ -31,23 +32,46 @@ from metoffice.constants import (
     ADDON_ID,
     API_KEY,
     SETTINGS_WINDOW_ID,
+    URLCACHE_OPTIONS,
     WEATHER_WINDOW_ID,
 )
 
-window = xbmcgui.Window(WEATHER_WINDOW_ID)
 addon = xbmcaddon.Addon(ADDON_ID)
 
 socket.setdefaulttimeout(20)
 
 
+def fetch():
+    """
+    Fetches the observation, daily and 3 hourly data concurrently.
+    Each fetch opens its own URLCache, so the threads share only the
+    files on disk and the connection pool.
+    """
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        observation = executor.submit(properties.fetch_observation)
+        daily = executor.submit(properties.fetch_daily)
+        threehourly = executor.submit(properties.fetch_threehourly)
+        return observation.result(), daily.result(), threehourly.result()
+
+
 def main():
     if sys.argv[1] in ["ObservationLocation", "ForecastLocation"]:
         setlocation.main(sys.argv[1])
         return
 
+    try:
+        refresh()
+    finally:
+        # Only now are the properties that have changed set on the window.
+        properties.window.publish()
+
+
+def refresh():
+    window = properties.window
+
     if addon.getSetting("EraseCache") == "true":
         try:
-            urlcache.URLCache(ADDON_DATA_PATH).erase()
+            urlcache.URLCache(ADDON_DATA_PATH, **URLCACHE_OPTIONS).erase()
         finally:
             addon.setSetting("EraseCache", "false")
 
@@ -67,9 +91,10 @@ def main():
         return
 
     try:
-        properties.observation()
-        properties.daily()
-        properties.threehourly()
+        observation, daily, threehourly = fetch()
+        properties.observation(observation)
+        properties.daily(daily)
+        properties.threehourly(threehourly)
         properties.sunrisesunset()
     except KeyError:
         # Expect KeyErrors to come from parsing JSON responses.
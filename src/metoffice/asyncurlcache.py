@@ -0,0 +1,208 @@
+# An asyncio counterpart of URLCache, sharing its folder and index.
+
+import asyncio
+import functools
+import itertools
+import os
+import socket
+import tempfile
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import xbmc
+
+from . import transport, utilities
+from .filelock import FileLock
+from .urlcache import (
+    COMPRESSION_SUFFIXES,
+    BodyWriter,
+    Download,
+    URLCache,
+)
+
+
+class AsyncURLCache(URLCache):
+    """
+    A URLCache whose get methods are coroutines, so that many fetches
+    can be in flight on one event loop without a thread each. Network
+    I/O is non-blocking, and downloads are written straight to the
+    cache folder. The index, the locks shared with other processes and
+    the breakers, failures and quotas files are worked on by a thread of
+    the cache's own, one call at a time, so the event loop doesn't wait
+    on them. The callbacks are called on that thread too.
+    An instance must only be used from the event loop that opened it.
+    The "sqlite" index suits large numbers of urls, as each fetch saves
+    the index.
+
+    The pool option is ignored: each request has a connection of its
+    own. Stale entries are refreshed by a task, left in _refresher,
+    once the cache is closed.
+    """
+
+    async def __aenter__(self):
+        # One thread, as sqlite connections can only be used from the
+        # thread that opened them, and the json index isn't thread safe.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            return await self._call(self.__enter__)
+        except BaseException:
+            self._executor.shutdown(wait=False)
+            raise
+
+    async def __aexit__(self, typ, value, traceback):
+        pending, self._pending = self._pending, []
+        try:
+            await self._call(self.__exit__, typ, value, traceback)
+        finally:
+            self._executor.shutdown(wait=False)
+        if pending:
+            self._refresher = asyncio.ensure_future(self._refresh_async(pending))
+
+    async def _call(self, func, *args):
+        # Runs func on the cache's thread, letting the loop carry on.
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args)
+        )
+
+    async def _refresh_async(self, pending):
+        async with AsyncURLCache(self._base, **self._options) as cache:
+            for url, expiry_callback, resource_callback in pending:
+                try:
+                    await cache._fetch_async(url, expiry_callback, resource_callback)
+                    cache.stats["refreshed"] += 1
+                except Exception as e:
+                    utilities.log(
+                        "Background refresh of {0} failed: {1}".format(url, e),
+                        xbmc.LOGWARNING,
+                    )
+
+    async def get(self, url, expiry_callback, resource_callback=None):
+        resource = await self._call(
+            self._lookup, url, expiry_callback, resource_callback
+        )
+        if resource is None:
+            self.stats["miss"] += 1
+            resource = await self._fetch_async(url, expiry_callback, resource_callback)
+        return resource
+
+    async def get_many(self, requests, max_workers=64):
+        """
+        As get, for several urls at once, at most `max_workers` of which
+        are fetched at a time. Returns the filenames in the order requested.
+        """
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def get(url, expiry_callback, resource_callback=None):
+            async with semaphore:
+                return await self.get(url, expiry_callback, resource_callback)
+
+        return await asyncio.gather(*(get(*request) for request in requests))
+
+    async def get_json(self, url, expiry_callback, resource_callback=None):
+        decode, expiry, resource = self._json_callbacks(
+            url, expiry_callback, resource_callback
+        )
+        return await self._call(decode, await self.get(url, expiry, resource))
+
+    async def _fetch_async(self, url, expiry_callback, resource_callback=None):
+        lock = FileLock(self._lockfile(url))
+        if not await self._acquire(lock):
+            utilities.log("Timed out waiting for {0}".format(url), xbmc.LOGWARNING)
+        try:
+            entry, resource = await self._call(self._prepare, url)
+            if resource is not None:
+                return resource
+            try:
+                download = await self._retrieve_async(url, self._conditions(entry))
+            except (socket.timeout, urllib.error.URLError) as e:
+                return await self._call(self._recover_from, url, entry, e)
+            return await self._call(
+                self._complete, url, entry, download, expiry_callback, resource_callback
+            )
+        finally:
+            lock.release()
+
+    def _prepare(self, url):
+        # The part of _fetch before the request. Returns the current entry
+        # for url, and the resource to serve instead of requesting it, if any.
+        entry = self._current(url)
+        if entry is not None and self._expiry(entry) >= datetime.now(timezone.utc):
+            self.stats["coalesced"] += 1
+            return entry, entry["resource"]
+        resource = self._adopt(url)
+        if resource is not None:
+            self._cache.save()
+            return entry, resource
+        return entry, self._answer(url, entry)
+
+    def _recover_from(self, url, entry, error):
+        # The part of _fetch after a failed request.
+        if not self._failed(url, error):
+            raise error
+        return self._fallback(url, entry, error)
+
+    def _complete(self, url, entry, download, expiry_callback, resource_callback):
+        # The part of _fetch after a successful request.
+        self._succeeded(url)
+        resource = self._record(
+            url, entry, download, expiry_callback, resource_callback
+        )
+        self._cache.save()
+        return resource
+
+    async def _acquire(self, lock):
+        # Polls for the lock, so that other fetches carry on meanwhile.
+        deadline = time.monotonic() + self.LOCK_TIMEOUT
+        while not lock.acquire(timeout=0):
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(FileLock.POLL_INTERVAL)
+        return True
+
+    async def _retrieve_async(self, url, headers=None):
+        for attempt in itertools.count():
+            try:
+                return await self._download_async(url, headers)
+            except (socket.timeout, urllib.error.URLError) as e:
+                if attempt >= self._retries or not await self._call(
+                    self._retry, url, e
+                ):
+                    raise
+                await asyncio.sleep(self._delay(attempt))
+
+    async def _download_async(self, url, headers=None):
+        conditional = bool(headers)
+        try:
+            response = await transport.async_urlopen(self._request(url, headers))
+        except urllib.error.HTTPError as e:
+            if conditional and e.code == 304:
+                return None
+            e.args = (str(e), url)
+            raise
+        except (socket.timeout, urllib.error.URLError) as e:
+            e.args = (str(e), url)
+            raise
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        tmp = tempfile.NamedTemporaryFile(
+            dir=self._folder, delete=False, suffix=COMPRESSION_SUFFIXES[self._compress]
+        )
+        try:
+            with tmp, self._writer(tmp) as fh:
+                async with response:
+                    digests = await self._stream_async(url, response, fh)
+        except BaseException:
+            os.remove(tmp.name)
+            raise
+        return Download(tmp.name, etag, last_modified, digests)
+
+    async def _stream_async(self, url, response, fh):
+        body = BodyWriter(url, response.headers, fh, self._checksums, self._max_size)
+        while True:
+            data = await response.read(self.CHUNK_SIZE)
+            body.write(data)
+            if not data:
+                return body.digests()
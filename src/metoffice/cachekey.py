@@ -0,0 +1,22 @@
+# Functions that map a url to the key it is cached under, for
+# URLCache's `key` option.
+
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+def strip_params(*names):
+    """
+    Returns a key function that drops the named query parameters from
+    a url, such as an API key that doesn't change the resource.
+    """
+    names = set(names)
+
+    def key(url):
+        parts = urlsplit(url)
+        params = parse_qsl(parts.query, keep_blank_values=True)
+        query = [(name, value) for name, value in params if name not in names]
+        if len(query) == len(params):
+            return url
+        return urlunsplit(parts._replace(query=urlencode(query, safe=",:/")))
+
+    return key
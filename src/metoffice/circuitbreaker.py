@@ -0,0 +1,95 @@
+# Per-host circuit breakers, so that while a host is failing it is
+# left alone rather than asked again on every refresh.
+
+import json
+import os
+import time
+
+from . import utilities
+from .filelock import FileLock
+
+
+class CircuitBreaker(object):
+    """
+    Counts consecutive failures for each host in a json file at `path`,
+    so that every process sharing the file sees the same state. After
+    `threshold` failures a host's breaker opens, and no requests should
+    be made to the host for `timeout` (a timedelta). Then one request is
+    let through: if it succeeds the breaker closes, otherwise it opens
+    again.
+    """
+
+    def __init__(self, path, threshold, timeout):
+        self._path = path
+        self._lock = FileLock(path + ".lock")
+        self._threshold = threshold
+        self._timeout = timeout.total_seconds()
+
+    def allow(self, host):
+        """
+        Whether a request may be made to host. Once the breaker has been
+        open for its timeout, the caller that is allowed through makes
+        the trial request; the breaker stays open for everyone else.
+        """
+        if host not in self._read():
+            return True
+        with self._lock:
+            hosts = self._read()
+            state = hosts.get(host)
+            if state is None or "opened" not in state:
+                return True
+            if time.time() - state["opened"] < self._timeout:
+                return False
+            state["opened"] = time.time()
+            self._write(hosts)
+        return True
+
+    def open_hosts(self):
+        """
+        The hosts whose breakers are currently open.
+        """
+        now = time.time()
+        return set(
+            host
+            for host, state in self._read().items()
+            if "opened" in state and now - state["opened"] < self._timeout
+        )
+
+    def success(self, host):
+        if host not in self._read():
+            return
+        with self._lock:
+            hosts = self._read()
+            if hosts.pop(host, None) is not None:
+                self._write(hosts)
+
+    def failure(self, host):
+        """
+        Records a failed request to host. Returns True if the breaker
+        is now open.
+        """
+        with self._lock:
+            hosts = self._read()
+            state = hosts.setdefault(host, {"failures": 0})
+            state["failures"] += 1
+            if state["failures"] >= self._threshold:
+                state["opened"] = time.time()
+            self._write(hosts)
+        return "opened" in state
+
+    def _read(self):
+        try:
+            with open(self._path) as fh:
+                hosts = json.load(fh)
+        except (IOError, ValueError):
+            return {}
+        return hosts if isinstance(hosts, dict) else {}
+
+    def _write(self, hosts):
+        utilities.atomic_write(self._path, json.dumps(hosts))
+
+    @staticmethod
+    def erase(path):
+        for suffix in ("", ".lock"):
+            if os.path.isfile(path + suffix):
+                os.remove(path + suffix)
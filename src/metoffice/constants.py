@@ -1,10 +1,14 @@
 import urllib.parse
+from datetime import timedelta
 
 import pytz
 import xbmc
 import xbmcaddon
 import xbmcvfs
 
+from .cachekey import strip_params
+from .transport import ConnectionPool
+
 # Magic numbers. See https://kodi.wiki/view/Window_IDs
 WEATHER_WINDOW_ID = 12600
 ADDON_BROWSER_WINDOW_ID = 10040
@@ -27,6 +31,10 @@ ADDON_BANNER_PATH = xbmcvfs.translatePath(
 ADDON_DATA_PATH = xbmcvfs.translatePath(
     "special://profile/addon_data/%s/" % addon().getAddonInfo("id")
 )
+# Shared by every Kodi profile, so a forecast is downloaded only once.
+SHARED_DATA_PATH = xbmcvfs.translatePath(
+    "special://masterprofile/addon_data/%s/shared/" % addon().getAddonInfo("id")
+)
 
 TEMPERATUREUNITS = xbmc.getRegion("tempunit")
 
@@ -48,6 +56,37 @@ MAPTIME_FORMAT = "%H%M %a"
 ISSUEDAT_FORMAT = "%H:%M %a %d %b %Y"
 TIME_FORMAT = "%H:%M"
 
+# Keyword arguments used whenever the addon opens its URLCache.
+URLCACHE_OPTIONS = {
+    "index": "sqlite",
+    "stale_window": timedelta(hours=3),
+    "max_bytes": 25 * 1024 * 1024,
+    "max_entries": 64,
+    "compress": "gzip",
+    "pool": ConnectionPool(),
+    "retries": 2,
+    "backoff": 1,
+    "breaker_threshold": 3,
+    "breaker_timeout": timedelta(minutes=15),
+    # A new API key changes the urls, so a 403 needn't be retried soon.
+    "negative_ttls": {
+        403: timedelta(hours=1),
+        404: timedelta(hours=1),
+        "5xx": timedelta(minutes=5),
+        "timeout": timedelta(minutes=2),
+    },
+    # DataPoint's fair use limits for each API key.
+    "rate_limits": {
+        "datapoint.metoffice.gov.uk": [
+            (100, timedelta(minutes=1)),
+            (5000, timedelta(days=1)),
+        ],
+    },
+    # Cache entries survive a change of API key, which is left out of the index.
+    "key": strip_params("key"),
+    "shared": SHARED_DATA_PATH,
+}
+
 RAW_DATAPOINT_IMG_WIDTH = 500
 CROP_WIDTH = 40
 CROP_HEIGHT = 20
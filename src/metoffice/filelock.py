@@ -0,0 +1,88 @@
+# Advisory file locks, for coordinating the processes (and threads)
+# that share the addon's data folder.
+
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock(object):
+    """
+    An exclusive lock on the file at `path`, which is created if need be.
+    Locks are held per open file, so two FileLocks on the same path
+    exclude each other even within a single process.
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, path, timeout=30):
+        self._path = path
+        self._timeout = timeout
+        self._fd = None
+
+    def acquire(self, timeout=None):
+        """
+        Waits up to `timeout` seconds for the lock. Returns True if
+        the lock was acquired, False otherwise.
+        """
+        if timeout is None:
+            timeout = self._timeout
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                _lock(fd)
+            except OSError:
+                if time.monotonic() >= deadline:
+                    os.close(fd)
+                    return False
+                time.sleep(self.POLL_INTERVAL)
+            else:
+                self._fd = fd
+                return True
+
+    def release(self):
+        if self._fd is not None:
+            try:
+                _unlock(self._fd)
+            finally:
+                os.close(self._fd)
+                self._fd = None
+
+    @property
+    def locked(self):
+        return self._fd is not None
+
+    def __enter__(self):
+        if not self.acquire():
+            raise LockTimeoutError("Timed out waiting for lock", self._path)
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self.release()
+
+
+def _lock(fd):
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+
+def _unlock(fd):
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class LockTimeoutError(Exception):
+    pass
@@ -0,0 +1,154 @@
+# A compact model of a DataPoint forecast or observation, built once
+# from the json so that the rest of the addon needn't walk it.
+
+import math
+from array import array
+
+
+class Column(object):
+    """
+    The values of one field of a Forecast's reps. `table` holds the
+    field's distinct values as DataPoint gives them, strings, or None
+    where missing, and `codes` each rep's index into it, as an array of
+    small ints. `numbers` holds the values as 32 bit floats, NaN where
+    they aren't numbers, built the first time it is asked for.
+    """
+
+    __slots__ = ("table", "codes", "_numbers")
+
+    def __init__(self, table, codes):
+        self.table = table
+        self.codes = codes
+        self._numbers = None
+
+    @classmethod
+    def from_reps(cls, reps, field):
+        lookup = {}
+        codes = [lookup.setdefault(rep.get(field), len(lookup)) for rep in reps]
+        return cls(list(lookup), array("H", codes))
+
+    def __getitem__(self, row):
+        return self.table[self.codes[row]]
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def numbers(self):
+        if self._numbers is None:
+            table = [number(value) for value in self.table]
+            self._numbers = array("f", [table[code] for code in self.codes])
+        return self._numbers
+
+
+class Forecast(object):
+    """
+    The reps of a DataPoint payload, held column by column in `columns`,
+    a dict of field to Column. Only the columns are kept, not the json.
+    `dates` are the dates of the periods, and each rep's date is its
+    "value" field.
+    """
+
+    __slots__ = ("issued", "dates", "columns", "_missing")
+
+    def __init__(self, issued, dates, reps, periods, fields=None):
+        self.issued = issued
+        self.dates = tuple(dates)
+        if fields is None:
+            fields = set().union(*reps)
+        self.columns = dict(
+            (field, Column.from_reps(reps, field))
+            for field in fields
+            if field != "value"
+        )
+        # Each rep's date is its period's.
+        self.columns["value"] = Column(list(self.dates), array("H", periods))
+        self._missing = Column([None], array("H", bytes(2 * len(reps))))
+
+    @classmethod
+    def from_json(cls, data, fields=None):
+        """
+        Builds a Forecast from a DataPoint payload, with columns for the
+        given fields, or for every field in the payload if fields is None.
+        """
+        dv = data["SiteRep"]["DV"]
+        dates = []
+        reps = []
+        periods = []
+        for p, period in enumerate(listed(dv["Location"]["Period"])):
+            dates.append(period.get("value"))
+            period_reps = listed(period["Rep"])
+            reps.extend(period_reps)
+            periods.extend([p] * len(period_reps))
+        return cls(dv.get("dataDate"), dates, reps, periods, fields)
+
+    def column(self, field):
+        """
+        The Column for field. A field without one is missing from every rep.
+        """
+        return self.columns.get(field, self._missing)
+
+    def rows(self, field, value):
+        """
+        The rows whose field has the given value.
+        """
+        column = self.column(field)
+        if value not in column.table:
+            return []
+        code = column.table.index(value)
+        return [row for row, other in enumerate(column.codes) if other == code]
+
+    def periods(self, rows):
+        """
+        The indexes into `dates` of the given rows' periods.
+        """
+        periods = self.columns["value"].codes
+        return [periods[row] for row in rows]
+
+    def __len__(self):
+        return len(self._missing)
+
+    def __getitem__(self, row):
+        length = len(self._missing)
+        if row < 0:
+            row += length
+        if not 0 <= row < length:
+            raise IndexError(row)
+        return Rep(self, row)
+
+    def __iter__(self):
+        for row in range(len(self._missing)):
+            yield Rep(self, row)
+
+
+class Rep(object):
+    """
+    One rep of a Forecast. get returns fields as DataPoint gives them,
+    as strings, so a Rep can stand in for the rep's json. number returns
+    a field as a float, NaN if it isn't a number.
+    """
+
+    __slots__ = ("_forecast", "row")
+
+    def __init__(self, forecast, row):
+        self._forecast = forecast
+        self.row = row
+
+    def get(self, field, default=None):
+        value = self._forecast.column(field)[self.row]
+        return default if value is None else value
+
+    def number(self, field):
+        return self._forecast.column(field).numbers[self.row]
+
+
+def number(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def listed(value):
+    # DataPoint gives a single period or rep as an object, not a list.
+    return [value] if isinstance(value, dict) else value
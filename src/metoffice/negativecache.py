@@ -0,0 +1,101 @@
+# Remembers failed requests for a while, so that a url that is
+# failing isn't requested again on every refresh.
+
+import json
+import os
+import socket
+import time
+import urllib.error
+
+from . import utilities
+from .filelock import FileLock
+
+
+class NegativeCache(object):
+    """
+    Failed requests, kept in a json file at `path` so that every process
+    sharing the file sees them. `ttls` maps what failed to how long (a
+    timedelta) the failure is remembered: an HTTP status such as 403, a
+    class of statuses such as "5xx", or "timeout" for requests that timed
+    out or couldn't connect. Failures not in `ttls` aren't remembered.
+    """
+
+    def __init__(self, path, ttls):
+        self._path = path
+        self._lock = FileLock(path + ".lock")
+        self._ttls = dict((key, ttl.total_seconds()) for key, ttl in ttls.items())
+
+    def get(self, url):
+        """
+        The error to raise for url if it failed recently, otherwise None.
+        """
+        failure = self._read().get(url)
+        if failure is None or failure["expiry"] < time.time():
+            return None
+        if failure.get("code") is None:
+            error = CachedURLError(failure["reason"], url)
+        else:
+            error = CachedHTTPError(url, failure["code"], failure["reason"], {}, None)
+        error.args = (str(error), url)
+        return error
+
+    def add(self, url, error):
+        """
+        Records that the request for url failed with error.
+        """
+        ttl = self._ttl(error)
+        if ttl is None:
+            return
+        now = time.time()
+        if isinstance(error, urllib.error.HTTPError):
+            failure = {"code": error.code, "reason": str(error.reason)}
+        else:
+            reason = getattr(error, "reason", error)
+            failure = {"code": None, "reason": str(reason)}
+        failure["expiry"] = now + ttl
+        with self._lock:
+            failures = dict(
+                (key, value)
+                for key, value in self._read().items()
+                if value["expiry"] >= now
+            )
+            failures[url] = failure
+            utilities.atomic_write(self._path, json.dumps(failures))
+
+    def _ttl(self, error):
+        if isinstance(error, urllib.error.HTTPError):
+            ttl = self._ttls.get(error.code)
+            if ttl is None:
+                ttl = self._ttls.get("%dxx" % (error.code // 100))
+            return ttl
+        if isinstance(error, (socket.timeout, urllib.error.URLError)):
+            return self._ttls.get("timeout")
+        return None
+
+    def _read(self):
+        try:
+            with open(self._path) as fh:
+                failures = json.load(fh)
+        except (IOError, ValueError):
+            return {}
+        return failures if isinstance(failures, dict) else {}
+
+    @staticmethod
+    def erase(path):
+        for suffix in ("", ".lock"):
+            if os.path.isfile(path + suffix):
+                os.remove(path + suffix)
+
+
+class NegativeCacheError(Exception):
+    """
+    Raised instead of making a request that recently failed.
+    """
+
+
+class CachedHTTPError(NegativeCacheError, urllib.error.HTTPError):
+    pass
+
+
+class CachedURLError(NegativeCacheError, urllib.error.URLError):
+    pass
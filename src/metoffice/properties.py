@@ -1,16 +1,13 @@
-import json
-import time
+import math
 from datetime import timedelta
+from functools import lru_cache
 
-import pytz
 import xbmcgui
 
-from . import astronomy, urlcache, utilities
+from . import astronomy, asyncurlcache, urlcache, utilities
 from .constants import (
     ADDON_DATA_PATH,
     DAILY_LOCATION_FORECAST_URL,
-    DATAPOINT_DATE_FORMAT,
-    DATAPOINT_DATETIME_FORMAT,
     FORECAST_LOCATION,
     FORECAST_LOCATION_ID,
     HOURLY_LOCATION_OBSERVATION_URL,
@@ -25,89 +22,186 @@ from .constants import (
     THREEHOURLY_LOCATION_FORECAST_URL,
     TIME_FORMAT,
     TZ,
+    URLCACHE_OPTIONS,
     WEATHER_CODES,
     WEATHER_WINDOW_ID,
 )
+from .forecast import Forecast
+from .propertymap import PropertyMap
+from .propertysink import PropertySink
 
-window = xbmcgui.Window(WEATHER_WINDOW_ID)
+# Published by default.main once the refresh is done.
+window = PropertySink(xbmcgui.Window(WEATHER_WINDOW_ID))
 
+# What each weather code looks like on the window.
+OUTLOOKS = dict((code, outlook) for code, (_, outlook) in WEATHER_CODES.items())
+ICONS = dict((code, "%s.png" % icon) for code, (icon, _) in WEATHER_CODES.items())
+FANART_CODES = dict((code, icon) for code, (icon, _) in WEATHER_CODES.items())
 
-def observation():
+
+def whole(x):
+    return str(round(float(x))).split(".")[0]
+
+
+def wind_kph(wind_speed):
+    if not wind_speed:
+        return "n/a"
+    return str(round(utilities.mph_to_kph(float(wind_speed)), 0))
+
+
+# The fields feels_like reads.
+FEELS_LIKE_FIELDS = ("T", "H", "S")
+
+
+def feels_like(rep):
+    temperature, humidity, wind_speed = map(rep.number, FEELS_LIKE_FIELDS)
+    if math.isnan(temperature + humidity + wind_speed):
+        return "n/a"
+    ws_mps = utilities.mph_to_mps(wind_speed)
+    return str(round(utilities.feels_like(temperature, humidity / 100, ws_mps)))
+
+
+def temperature(t):
+    return utilities.localised_temperature(t) + TEMPERATUREUNITS
+
+
+def rounded_temperature(t):
+    return utilities.rownd(utilities.localised_temperature(t)) + TEMPERATUREUNITS
+
+
+def feels_like_temperature(t):
+    return utilities.rownd(utilities.localised_temperature(t))
+
+
+def percentage(x):
+    return x + "%"
+
+
+def time_of_day(minutes):
+    return utilities.minutes_as_time(int(minutes))
+
+
+@lru_cache(maxsize=32)
+def short_day(date):
+    return utilities.isoparse(date).strftime(SHORT_DAY_FORMAT)
+
+
+@lru_cache(maxsize=32)
+def short_date(date):
+    return utilities.isoparse(date).strftime(SHORT_DATE_FORMAT)
+
+
+OBSERVATION = PropertyMap(
+    [
+        ("Current.Condition", "W", "na", OUTLOOKS.__getitem__),
+        ("Current.Visibility", "V", "n/a"),
+        ("Current.Pressure", "P", "n/a"),
+        ("Current.Temperature", "T", "n/a", whole),
+        ("Current.Wind", "S", None, wind_kph),
+        ("Current.WindDirection", "D", "n/a"),
+        ("Current.WindGust", "G", "n/a"),
+        ("Current.OutlookIcon", "W", "na", ICONS.__getitem__),
+        ("Current.FanartCode", "W", "na", ICONS.__getitem__),
+        ("Current.DewPoint", "Dp", "n/a", whole),
+        ("Current.FeelsLike", None, None, feels_like),
+        ("Current.Humidity", "H", "n/a", whole),
+    ]
+)
+
+# Daily properties are numbered from 0 for Day%d and from 1 for Daily.%d.
+DAILY_PERIOD = PropertyMap(
+    [
+        ("Day{0}.Title", "value", None, short_day),
+        ("Daily.{1}.ShortDay", "value", None, short_day),
+        ("Daily.{1}.ShortDate", "value", None, short_date),
+    ]
+)
+
+DAILY_REP = {
+    "Day": PropertyMap(
+        [
+            ("Day{0}.HighTemp", "Dm", "na"),
+            ("Day{0}.HighTempIcon", "Dm"),
+            ("Day{0}.Outlook", "W", "na", OUTLOOKS.__getitem__),
+            ("Day{0}.OutlookIcon", "W", "na", ICONS.__getitem__),
+            ("Day{0}.WindSpeed", "S", "na"),
+            ("Day{0}.WindDirection", "D", "na", str.lower),
+            # "Extended" properties used by some skins.
+            ("Daily.{1}.HighTemperature", "Dm", "na", temperature),
+            ("Daily.{1}.HighTempIcon", "Dm"),
+            ("Daily.{1}.Outlook", "W", "na", OUTLOOKS.__getitem__),
+            ("Daily.{1}.OutlookIcon", "W", "na", ICONS.__getitem__),
+            ("Daily.{1}.FanartCode", "W", "na", FANART_CODES.__getitem__),
+            ("Daily.{1}.WindSpeed", "S", "na"),
+            ("Daily.{1}.WindDirection", "D", "na", str.lower),
+        ]
+    ),
+    "Night": PropertyMap(
+        [
+            ("Day{0}.LowTemp", "Nm", "na"),
+            ("Day{0}.LowTempIcon", "Nm"),
+            ("Daily.{1}.LowTemperature", "Nm", "na", temperature),
+            ("Daily.{1}.LowTempIcon", "Nm"),
+        ]
+    ),
+}
+
+THREEHOURLY = PropertyMap(
+    [
+        ("Hourly.{1}.Outlook", "W", "na", OUTLOOKS.__getitem__),
+        ("Hourly.{1}.WindSpeed", "S", "n/a"),
+        ("Hourly.{1}.WindDirection", "D", "na", str.lower),
+        ("Hourly.{1}.GustSpeed", "G", "n/a"),
+        ("Hourly.{1}.UVIndex", "U", "n/a"),
+        ("Hourly.{1}.Precipitation", "Pp", None, percentage),
+        ("Hourly.{1}.OutlookIcon", "W", "na", ICONS.__getitem__),
+        ("Hourly.{1}.Time", "$", None, time_of_day),
+        ("Hourly.{1}.Temperature", "T", "na", rounded_temperature),
+        ("Hourly.{1}.ActualTempIcon", "T", "na"),
+        ("Hourly.{1}.FeelsLikeTemp", "F", "na", feels_like_temperature),
+        ("Hourly.{1}.FeelsLikeTempIcon", "F", "na"),
+        ("Hourly.{1}.ShortDate", "value", None, short_date),
+    ]
+)
+
+
+# The fields each payload's Forecast is built with.
+OBSERVATION_FIELDS = OBSERVATION.fields.union(FEELS_LIKE_FIELDS)
+DAILY_FIELDS = frozenset(["$"]).union(*[m.fields for m in DAILY_REP.values()])
+THREEHOURLY_FIELDS = THREEHOURLY.fields
+
+
+def fetch_observation():
+    utilities.log(
+        "Fetching Hourly Observation for '%s (%s)' from the Met Office..."
+        % (OBSERVATION_LOCATION, OBSERVATION_LOCATION_ID)
+    )
+    with urlcache.URLCache(ADDON_DATA_PATH, **URLCACHE_OPTIONS) as cache:
+        return cache.get_json(HOURLY_LOCATION_OBSERVATION_URL, observation_expiry)
+
+
+async def fetch_observation_async():
     utilities.log(
         "Fetching Hourly Observation for '%s (%s)' from the Met Office..."
         % (OBSERVATION_LOCATION, OBSERVATION_LOCATION_ID)
     )
-    with urlcache.URLCache(ADDON_DATA_PATH) as cache:
-        filename = cache.get(HOURLY_LOCATION_OBSERVATION_URL, observation_expiry)
-        with open(filename) as fh:
-            data = json.load(fh)
+    async with asyncurlcache.AsyncURLCache(
+        ADDON_DATA_PATH, **URLCACHE_OPTIONS
+    ) as cache:
+        return await cache.get_json(HOURLY_LOCATION_OBSERVATION_URL, observation_expiry)
+
+
+def observation(data=None):
+    if data is None:
+        data = fetch_observation()
     try:
-        dv = data["SiteRep"]["DV"]
-        dataDate = utilities.strptime(
-            dv.get("dataDate").rstrip("Z"), DATAPOINT_DATETIME_FORMAT
-        ).replace(tzinfo=pytz.utc)
+        observations = Forecast.from_json(data, OBSERVATION_FIELDS)
+        dataDate = utilities.isoparse(observations.issued)
         window.setProperty(
             "HourlyObservation.IssuedAt",
             dataDate.astimezone(TZ).strftime(ISSUEDAT_FORMAT),
         )
-        try:
-            latest_period = dv["Location"]["Period"][-1]
-        except KeyError:
-            latest_period = dv["Location"]["Period"]
-        try:
-            latest_obs = latest_period["Rep"][-1]
-        except KeyError:
-            latest_obs = latest_period["Rep"]
-        window.setProperty(
-            "Current.Condition", WEATHER_CODES[latest_obs.get("W", "na")][1]
-        )
-        window.setProperty("Current.Visibility", latest_obs.get("V", "n/a"))
-        window.setProperty("Current.Pressure", latest_obs.get("P", "n/a"))
-        window.setProperty(
-            "Current.Temperature",
-            str(round(float(latest_obs.get("T", "n/a")))).split(".")[0],
-        )
-        window.setProperty("Current.FeelsLike", "n/a")
-        # if we get Wind, then convert it to kmph.
-        wind_speed = latest_obs.get("S")
-        if wind_speed:
-            window.setProperty(
-                "Current.Wind", str(round(utilities.mph_to_kph(float(wind_speed)), 0))
-            )
-        else:
-            window.setProperty("Current.Wind", "n/a")
-        window.setProperty("Current.WindDirection", latest_obs.get("D", "n/a"))
-        window.setProperty("Current.WindGust", latest_obs.get("G", "n/a"))
-        window.setProperty(
-            "Current.OutlookIcon",
-            "%s.png" % WEATHER_CODES[latest_obs.get("W", "na")][0],
-        )
-        window.setProperty(
-            "Current.FanartCode", "%s.png" % WEATHER_CODES[latest_obs.get("W", "na")][0]
-        )
-        window.setProperty(
-            "Current.DewPoint",
-            str(round(float(latest_obs.get("Dp", "n/a")))).split(".")[0],
-        )
-        humidity = latest_obs.get("H")
-        temperature = latest_obs.get("T")
-        if humidity and temperature and wind_speed:
-            ws_mps = utilities.mph_to_mps(float(wind_speed))
-            feels_like = utilities.feels_like(
-                float(temperature), float(humidity) / 100, ws_mps
-            )
-            window.setProperty(
-                "Current.FeelsLike",
-                str(round(feels_like)),
-            )
-        else:
-            window.setProperty("Current.FeelsLike", "n/a")
-
-        window.setProperty(
-            "Current.Humidity",
-            str(round(float(latest_obs.get("H", "n/a")))).split(".")[0],
-        )
-
+        OBSERVATION.apply(window, observations[-1])
         window.setProperty("HourlyObservation.IsFetched", "true")
 
     except KeyError as e:
@@ -119,98 +213,41 @@ def observation():
         raise
 
 
-def daily():
+def fetch_daily():
+    utilities.log(
+        "Fetching Daily Forecast for '%s (%s)' from the Met Office..."
+        % (FORECAST_LOCATION, FORECAST_LOCATION_ID)
+    )
+    with urlcache.URLCache(ADDON_DATA_PATH, **URLCACHE_OPTIONS) as cache:
+        return cache.get_json(DAILY_LOCATION_FORECAST_URL, daily_expiry)
+
+
+async def fetch_daily_async():
     utilities.log(
         "Fetching Daily Forecast for '%s (%s)' from the Met Office..."
         % (FORECAST_LOCATION, FORECAST_LOCATION_ID)
     )
-    with urlcache.URLCache(ADDON_DATA_PATH) as cache:
-        filename = cache.get(DAILY_LOCATION_FORECAST_URL, daily_expiry)
-        with open(filename) as fh:
-            data = json.load(fh)
+    async with asyncurlcache.AsyncURLCache(
+        ADDON_DATA_PATH, **URLCACHE_OPTIONS
+    ) as cache:
+        return await cache.get_json(DAILY_LOCATION_FORECAST_URL, daily_expiry)
+
+
+def daily(data=None):
+    if data is None:
+        data = fetch_daily()
     try:
-        dv = data["SiteRep"]["DV"]
-        dataDate = utilities.strptime(
-            dv.get("dataDate").rstrip("Z"), DATAPOINT_DATETIME_FORMAT
-        ).replace(tzinfo=pytz.utc)
+        forecast = Forecast.from_json(data, DAILY_FIELDS)
+        dataDate = utilities.isoparse(forecast.issued)
         window.setProperty(
             "DailyForecast.IssuedAt", dataDate.astimezone(TZ).strftime(ISSUEDAT_FORMAT)
         )
-        for p, period in enumerate(dv["Location"]["Period"]):
-            window.setProperty(
-                "Day%d.Title" % p,
-                time.strftime(
-                    SHORT_DAY_FORMAT,
-                    time.strptime(period.get("value"), DATAPOINT_DATE_FORMAT),
-                ),
-            )
-            window.setProperty(
-                "Daily.%d.ShortDay" % (p + 1),
-                time.strftime(
-                    SHORT_DAY_FORMAT,
-                    time.strptime(period.get("value"), DATAPOINT_DATE_FORMAT),
-                ),
-            )
-            window.setProperty(
-                "Daily.%d.ShortDate" % (p + 1),
-                time.strftime(
-                    SHORT_DATE_FORMAT,
-                    time.strptime(period.get("value"), DATAPOINT_DATE_FORMAT),
-                ),
-            )
-            for rep in period["Rep"]:
-                weather_type = rep.get("W", "na")
-                if rep.get("$") == "Day":
-                    window.setProperty("Day%d.HighTemp" % p, rep.get("Dm", "na"))
-                    window.setProperty("Day%d.HighTempIcon" % p, rep.get("Dm"))
-                    window.setProperty(
-                        "Day%d.Outlook" % p, WEATHER_CODES.get(weather_type)[1]
-                    )
-                    window.setProperty(
-                        "Day%d.OutlookIcon" % p,
-                        "%s.png" % WEATHER_CODES.get(weather_type, "na")[0],
-                    )
-                    window.setProperty("Day%d.WindSpeed" % p, rep.get("S", "na"))
-                    window.setProperty(
-                        "Day%d.WindDirection" % p, rep.get("D", "na").lower()
-                    )
-
-                    # "Extended" properties used by some skins.
-                    window.setProperty(
-                        "Daily.%d.HighTemperature" % (p + 1),
-                        utilities.localised_temperature(rep.get("Dm", "na"))
-                        + TEMPERATUREUNITS,
-                    )
-                    window.setProperty("Daily.%d.HighTempIcon" % (p + 1), rep.get("Dm"))
-                    window.setProperty(
-                        "Daily.%d.Outlook" % (p + 1), WEATHER_CODES.get(weather_type)[1]
-                    )
-                    window.setProperty(
-                        "Daily.%d.OutlookIcon" % (p + 1),
-                        "%s.png" % WEATHER_CODES.get(weather_type, "na")[0],
-                    )
-                    window.setProperty(
-                        "Daily.%d.FanartCode" % (p + 1),
-                        WEATHER_CODES.get(weather_type, "na")[0],
-                    )
-                    window.setProperty(
-                        "Daily.%d.WindSpeed" % (p + 1), rep.get("S", "na")
-                    )
-                    window.setProperty(
-                        "Daily.%d.WindDirection" % (p + 1), rep.get("D", "na").lower()
-                    )
-
-                elif rep.get("$") == "Night":
-                    window.setProperty("Day%d.LowTemp" % p, rep.get("Nm", "na"))
-                    window.setProperty("Day%d.LowTempIcon" % p, rep.get("Nm"))
-
-                    window.setProperty(
-                        "Daily.%d.LowTemperature" % (p + 1),
-                        utilities.localised_temperature(rep.get("Nm", "na"))
-                        + TEMPERATUREUNITS,
-                    )
-                    window.setProperty("Daily.%d.LowTempIcon" % (p + 1), rep.get("Nm"))
-
+        for p, date in enumerate(forecast.dates):
+            DAILY_PERIOD.apply(window, {"value": date}, p)
+        for name, mapping in DAILY_REP.items():
+            rows = forecast.rows("$", name)
+            periods = forecast.periods(rows)
+            mapping.apply_rows(window, forecast, rows, periods)
     except KeyError as e:
         e.args = (
             "Key Error in JSON File",
@@ -222,74 +259,39 @@ def daily():
     window.setProperty("Daily.IsFetched", "true")
 
 
-def threehourly():
+def fetch_threehourly():
     utilities.log(
         "Fetching 3 Hourly Forecast for '%s (%s)' from the Met Office..."
         % (FORECAST_LOCATION, FORECAST_LOCATION_ID)
     )
-    with urlcache.URLCache(ADDON_DATA_PATH) as cache:
-        filename = cache.get(THREEHOURLY_LOCATION_FORECAST_URL, threehourly_expiry)
-        with open(filename) as fh:
-            data = json.load(fh)
+    with urlcache.URLCache(ADDON_DATA_PATH, **URLCACHE_OPTIONS) as cache:
+        return cache.get_json(THREEHOURLY_LOCATION_FORECAST_URL, threehourly_expiry)
+
+
+async def fetch_threehourly_async():
+    utilities.log(
+        "Fetching 3 Hourly Forecast for '%s (%s)' from the Met Office..."
+        % (FORECAST_LOCATION, FORECAST_LOCATION_ID)
+    )
+    async with asyncurlcache.AsyncURLCache(
+        ADDON_DATA_PATH, **URLCACHE_OPTIONS
+    ) as cache:
+        return await cache.get_json(
+            THREEHOURLY_LOCATION_FORECAST_URL, threehourly_expiry
+        )
+
+
+def threehourly(data=None):
+    if data is None:
+        data = fetch_threehourly()
     try:
-        dv = data["SiteRep"]["DV"]
-        dataDate = utilities.strptime(
-            dv.get("dataDate").rstrip("Z"), DATAPOINT_DATETIME_FORMAT
-        ).replace(tzinfo=pytz.utc)
+        forecast = Forecast.from_json(data, THREEHOURLY_FIELDS)
+        dataDate = utilities.isoparse(forecast.issued)
         window.setProperty(
             "3HourlyForecast.IssuedAt",
             dataDate.astimezone(TZ).strftime(ISSUEDAT_FORMAT),
         )
-        count = 1
-        for period in dv["Location"]["Period"]:
-            for rep in period["Rep"]:
-                # extra xbmc targeted info:
-                weather_type = rep.get("W", "na")
-                window.setProperty(
-                    "Hourly.%d.Outlook" % count, WEATHER_CODES.get(weather_type)[1]
-                )
-                window.setProperty("Hourly.%d.WindSpeed" % count, rep.get("S", "n/a"))
-                window.setProperty(
-                    "Hourly.%d.WindDirection" % count, rep.get("D", "na").lower()
-                )
-                window.setProperty("Hourly.%d.GustSpeed" % count, rep.get("G", "n/a"))
-                window.setProperty("Hourly.%d.UVIndex" % count, rep.get("U", "n/a"))
-                window.setProperty(
-                    "Hourly.%d.Precipitation" % count, rep.get("Pp") + "%"
-                )
-                window.setProperty(
-                    "Hourly.%d.OutlookIcon" % count,
-                    "%s.png" % WEATHER_CODES.get(weather_type, "na")[0],
-                )
-                window.setProperty(
-                    "Hourly.%d.ShortDate" % count,
-                    time.strftime(
-                        SHORT_DATE_FORMAT,
-                        time.strptime(period.get("value"), DATAPOINT_DATE_FORMAT),
-                    ),
-                )
-                window.setProperty(
-                    "Hourly.%d.Time" % count,
-                    utilities.minutes_as_time(int(rep.get("$"))),
-                )
-                window.setProperty(
-                    "Hourly.%d.Temperature" % count,
-                    utilities.rownd(utilities.localised_temperature(rep.get("T", "na")))
-                    + TEMPERATUREUNITS,
-                )
-                window.setProperty(
-                    "Hourly.%d.ActualTempIcon" % count, rep.get("T", "na")
-                )
-                window.setProperty(
-                    "Hourly.%d.FeelsLikeTemp" % count,
-                    utilities.rownd(
-                        utilities.localised_temperature(rep.get("F", "na"))
-                    ),
-                )
-                window.setProperty(
-                    "Hourly.%d.FeelsLikeTempIcon" % count, rep.get("F", "na")
-                )
-                count += 1
+        THREEHOURLY.apply_rows(window, forecast, range(len(forecast)))
     except KeyError as e:
         e.args = (
             "Key Error in JSON File",
@@ -306,35 +308,21 @@ def sunrisesunset():
     window.setProperty("Today.Sunset", sun.sunset().strftime(TIME_FORMAT))
 
 
-def daily_expiry(filename):
-    with open(filename) as fh:
-        data = json.load(fh)
-    dataDate = data["SiteRep"]["DV"]["dataDate"].rstrip("Z")
-    return utilities.strptime(dataDate, DATAPOINT_DATETIME_FORMAT) + timedelta(
-        hours=1.5
-    )
+def daily_expiry(data):
+    dataDate = data["SiteRep"]["DV"]["dataDate"]
+    return utilities.isoparse(dataDate) + timedelta(hours=1.5)
 
 
-def threehourly_expiry(filename):
-    with open(filename) as fh:
-        data = json.load(fh)
-    dataDate = data["SiteRep"]["DV"]["dataDate"].rstrip("Z")
-    return utilities.strptime(dataDate, DATAPOINT_DATETIME_FORMAT) + timedelta(
-        hours=1.5
-    )
+def threehourly_expiry(data):
+    dataDate = data["SiteRep"]["DV"]["dataDate"]
+    return utilities.isoparse(dataDate) + timedelta(hours=1.5)
 
 
-def text_expiry(filename):
-    with open(filename) as fh:
-        data = json.load(fh)
-    issuedAt = data["RegionalFcst"]["issuedAt"].rstrip("Z")
-    return utilities.strptime(issuedAt, DATAPOINT_DATETIME_FORMAT) + timedelta(hours=12)
+def text_expiry(data):
+    issuedAt = data["RegionalFcst"]["issuedAt"]
+    return utilities.isoparse(issuedAt) + timedelta(hours=12)
 
 
-def observation_expiry(filename):
-    with open(filename) as fh:
-        data = json.load(fh)
-    dataDate = data["SiteRep"]["DV"]["dataDate"].rstrip("Z")
-    return utilities.strptime(dataDate, DATAPOINT_DATETIME_FORMAT) + timedelta(
-        hours=1.5
-    )
+def observation_expiry(data):
+    dataDate = data["SiteRep"]["DV"]["dataDate"]
+    return utilities.isoparse(dataDate) + timedelta(hours=1.5)
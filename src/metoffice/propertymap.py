@@ -0,0 +1,107 @@
+# Table driven mapping of DataPoint reports onto window properties.
+
+
+class PropertyMap(object):
+    """
+    Sets window properties from a dict, such as a DataPoint Rep, as laid
+    out by `specs`: a sequence of (key, field, default, format) tuples,
+    the last two optional. Each property's value is item.get(field,
+    default), or the item itself if field is None, passed through
+    format unless that is None.
+
+    Keys are templates, formatted with the index the item is applied
+    with and that index plus one, for example "Day{0}.Outlook" or
+    "Hourly.{1}.Outlook". The specs are compiled once, and the keys for
+    an index are expanded the first time the index is used.
+
+    `fields` are the fields the specs read, those a Forecast applied
+    with apply_rows needs columns for.
+    """
+
+    def __init__(self, specs):
+        specs = [tuple(spec) + (None,) * (4 - len(spec)) for spec in specs]
+        self._templates = tuple(spec[0] for spec in specs)
+        # The specs' operations grouped by field, each with the positions
+        # of the specs it is found in.
+        fields = {}
+        for position, (_, field, default, format) in enumerate(specs):
+            operations = fields.setdefault(field, {})
+            operations.setdefault((default, format), []).append(position)
+        self._fields = tuple(
+            (field, [(tuple(p), d, f) for (d, f), p in operations.items()])
+            for field, operations in fields.items()
+        )
+        self.fields = frozenset(field for field in fields if field is not None)
+        self._keys = {}
+        self._key_columns = {}
+
+    def keys(self, index=0):
+        try:
+            return self._keys[index]
+        except KeyError:
+            keys = tuple(
+                template.format(index, index + 1) for template in self._templates
+            )
+            self._keys[index] = keys
+            return keys
+
+    def apply(self, window, item, index=0):
+        keys = self.keys(index)
+        get = item.get
+        set_property = window.setProperty
+        for field, operations in self._fields:
+            for positions, default, format in operations:
+                value = item if field is None else get(field, default)
+                if format is not None:
+                    value = format(value)
+                for position in positions:
+                    set_property(keys[position], value)
+
+    def apply_rows(self, window, forecast, rows, indexes=None):
+        """
+        As apply, for each of the given rows of a Forecast, with the
+        corresponding index, or the rows' positions if indexes is None.
+        Works a field at a time, and specs that only differ in their keys
+        share their values. When every row is applied, each of a field's
+        distinct values is formatted once.
+        """
+        rows = list(rows)
+        keys = self.key_columns(range(len(rows)) if indexes is None else indexes)
+        set_property = window.setProperty
+        every_row = rows == list(range(len(forecast)))
+        for field, operations in self._fields:
+            codes = None
+            if field is None:
+                table = [forecast[row] for row in rows]
+            else:
+                column = forecast.column(field)
+                table, codes = column.table, column.codes
+                if not every_row:
+                    # Values only found in other rows mustn't be formatted.
+                    table = [table[codes[row]] for row in rows]
+                    codes = None
+            for positions, default, format in operations:
+                values = table
+                if default is not None and None in values:
+                    values = [default if value is None else value for value in values]
+                if format is not None:
+                    values = list(map(format, values))
+                if codes is not None:
+                    values = [values[code] for code in codes]
+                for position in positions:
+                    for key, value in zip(keys[position], values):
+                        set_property(key, value)
+
+    def key_columns(self, indexes):
+        """
+        The keys for each of the given indexes, transposed: a tuple per
+        spec of its keys in the order of the indexes.
+        """
+        indexes = tuple(indexes)
+        try:
+            return self._key_columns[indexes]
+        except KeyError:
+            columns = tuple(zip(*[self.keys(index) for index in indexes]))
+            columns = columns or ((),) * len(self._templates)
+            self._key_columns[indexes] = columns
+            return columns
@@ -0,0 +1,48 @@
+# Buffers the window properties set during a refresh, so that only
+# those that have changed are passed to Kodi.
+
+from collections import Counter, OrderedDict
+
+import xbmc
+
+from . import utilities
+
+
+class PropertySink(object):
+    """
+    Stands in for an xbmcgui.Window. Properties set on it are held until
+    publish, which sets on the window only those whose values differ from
+    the window's own. Reading a property doesn't redraw the window, and
+    the window is compared rather than what was last published, so values
+    left by anything else, such as another weather addon, are replaced.
+    """
+
+    def __init__(self, window):
+        self._window = window
+        self._pending = OrderedDict()
+        self.stats = Counter()
+
+    def setProperty(self, key, value):
+        self._pending[key] = value
+
+    def publish(self):
+        """
+        Sets the changed properties on the window. Returns how many
+        were set.
+        """
+        self.stats = Counter()
+        get_property = self._window.getProperty
+        for key, value in self._pending.items():
+            if get_property(key) == value:
+                self.stats["unchanged"] += 1
+                continue
+            self._window.setProperty(key, value)
+            self.stats["set"] += 1
+        self._pending = OrderedDict()
+        utilities.log(
+            "Set {0} window properties, {1} unchanged".format(
+                self.stats["set"], self.stats["unchanged"]
+            ),
+            xbmc.LOGDEBUG,
+        )
+        return self.stats["set"]
@@ -0,0 +1,94 @@
+# Client side accounting of API quotas, so that requests stay within
+# them rather than being throttled by the server.
+
+import json
+import os
+import time
+
+from . import utilities
+from .filelock import FileLock
+
+
+class RateLimiter(object):
+    """
+    Token buckets for each host, kept in a json file at `path` so that
+    every process sharing the file draws on the same budget. `limits`
+    maps a host to a list of (calls, period) quotas, period being a
+    timedelta, for example [(100, timedelta(minutes=1))]. Each quota
+    is a bucket of `calls` tokens that refills steadily over `period`.
+    Hosts without limits are never held back.
+
+    A host's budget is low once any of its buckets is below `reserve`,
+    a fraction of that bucket's size.
+    """
+
+    def __init__(self, path, limits, reserve=0.1):
+        self._path = path
+        self._limits = dict(
+            (host, [(calls, period.total_seconds()) for calls, period in quotas])
+            for host, quotas in limits.items()
+        )
+        self._reserve = reserve
+
+    def acquire(self, host):
+        """
+        Takes a token from each of host's buckets. Returns False, taking
+        nothing, if any of them is empty.
+        """
+        quotas = self._limits.get(host)
+        if not quotas:
+            return True
+        # A lock per call, so that one limiter can be used from any thread.
+        with FileLock(self._path + ".lock"):
+            hosts = self._read()
+            tokens = self._refill(quotas, hosts.get(host))
+            if min(tokens) < 1:
+                return False
+            hosts[host] = {
+                "tokens": [t - 1 for t in tokens],
+                "updated": time.time(),
+            }
+            utilities.atomic_write(self._path, json.dumps(hosts))
+        return True
+
+    def remaining(self, host):
+        """
+        How many requests can be made to host right now, or None if
+        it has no limits.
+        """
+        quotas = self._limits.get(host)
+        if not quotas:
+            return None
+        return int(min(self._refill(quotas, self._read().get(host))))
+
+    def low(self, host):
+        quotas = self._limits.get(host)
+        if not quotas:
+            return False
+        tokens = self._refill(quotas, self._read().get(host))
+        return any(t < calls * self._reserve for t, (calls, _) in zip(tokens, quotas))
+
+    @staticmethod
+    def _refill(quotas, state):
+        # The tokens in each bucket now. Buckets start full.
+        if state is None or len(state["tokens"]) != len(quotas):
+            return [float(calls) for calls, _ in quotas]
+        elapsed = max(0, time.time() - state["updated"])
+        return [
+            min(calls, tokens + elapsed * calls / period)
+            for tokens, (calls, period) in zip(state["tokens"], quotas)
+        ]
+
+    def _read(self):
+        try:
+            with open(self._path) as fh:
+                hosts = json.load(fh)
+        except (IOError, ValueError):
+            return {}
+        return hosts if isinstance(hosts, dict) else {}
+
+    @staticmethod
+    def erase(path):
+        for suffix in ("", ".lock"):
+            if os.path.isfile(path + suffix):
+                os.remove(path + suffix)
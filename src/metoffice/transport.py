@@ -0,0 +1,341 @@
+# Persistent HTTP connections, so that several requests to the same
+# host only pay for the TCP (and TLS) handshake once, and an asyncio
+# client for the same requests.
+
+import asyncio
+import email.parser
+import http.client
+import io
+import socket
+import ssl
+import threading
+import urllib.error
+from urllib.parse import urljoin, urlsplit
+
+
+class ConnectionPool(object):
+    """
+    Keeps connections open between requests, up to `max_per_host` idle
+    connections for each host. urlopen() takes a urllib.request.Request
+    and behaves like urllib.request.urlopen for the simple requests made
+    by this addon: redirects are followed, and error statuses (including
+    304) are raised as urllib.error.HTTPError. Proxies are not supported.
+
+    A response must be read to the end and closed for its connection to
+    be reused.
+    """
+
+    MAX_REDIRECTS = 5
+    REDIRECTS = (301, 302, 303, 307, 308)
+
+    def __init__(self, max_per_host=2, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        self._max_per_host = max_per_host
+        self._timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.connections = 0
+
+    def urlopen(self, req):
+        url = req.full_url
+        headers = dict(req.header_items())
+        for _ in range(self.MAX_REDIRECTS + 1):
+            response = self._request(req.get_method(), url, headers)
+            location = response.headers.get("Location")
+            if response.status in self.REDIRECTS and location:
+                response.read()
+                response.close()
+                url = urljoin(url, location)
+                continue
+            if not 200 <= response.status < 300:
+                raise self._error(url, response, response.reason)
+            return response
+        raise self._error(url, response, "Too many redirects")
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    @staticmethod
+    def _error(url, response, reason):
+        # Reading the body lets the connection be reused.
+        body = response.read()
+        response.close()
+        return urllib.error.HTTPError(
+            url, response.status, reason, response.headers, io.BytesIO(body)
+        )
+
+    def _request(self, method, url, headers):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        connection = self._checkout(key)
+        if connection is not None:
+            try:
+                return self._send(key, connection, method, path, headers, url)
+            except (http.client.RemoteDisconnected, ConnectionError):
+                # The server closed the idle connection; try a new one.
+                connection.close()
+            except OSError as e:
+                connection.close()
+                raise urllib.error.URLError(e)
+        connection = self._connect(key)
+        try:
+            return self._send(key, connection, method, path, headers, url)
+        except OSError as e:
+            connection.close()
+            raise urllib.error.URLError(e)
+
+    def _send(self, key, connection, method, path, headers, url):
+        connection.request(method, path, headers=headers)
+        response = connection.getresponse()
+        return PooledResponse(self, key, connection, response, url)
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(host, port, timeout=self._timeout)
+        elif scheme == "http":
+            connection = http.client.HTTPConnection(host, port, timeout=self._timeout)
+        else:
+            raise urllib.error.URLError("unknown url type: %s" % scheme)
+        self.connections += 1
+        return connection
+
+    def _checkout(self, key):
+        with self._lock:
+            connections = self._idle.get(key)
+            if connections:
+                return connections.pop()
+        return None
+
+    def _checkin(self, key, connection):
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self._max_per_host:
+                connections.append(connection)
+                return
+        connection.close()
+
+
+class PooledResponse(object):
+    # Wraps an http.client.HTTPResponse, returning its connection to
+    # the pool when closed.
+
+    def __init__(self, pool, key, connection, response, url):
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def read(self, amt=None):
+        return self._response.read(amt)
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.status
+
+    def close(self):
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        if self._response.isclosed() and not self._response.will_close:
+            self._pool._checkin(self._key, connection)
+        else:
+            self._response.close()
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self.close()
+
+
+async def async_urlopen(req, timeout=None):
+    """
+    The asyncio counterpart of ConnectionPool.urlopen. Each request
+    opens a connection of its own, which is closed with the response.
+    `timeout` applies to each network operation, and defaults to the
+    socket module's default timeout.
+    """
+    if timeout is None:
+        timeout = socket.getdefaulttimeout()
+    url = req.full_url
+    headers = dict(req.header_items())
+    for _ in range(ConnectionPool.MAX_REDIRECTS + 1):
+        response = await _async_request(req.get_method(), url, headers, timeout)
+        location = response.headers.get("Location")
+        if response.status in ConnectionPool.REDIRECTS and location:
+            response.close()
+            url = urljoin(url, location)
+            continue
+        if not 200 <= response.status < 300:
+            raise await _async_error(url, response, response.reason)
+        return response
+    raise await _async_error(url, response, "Too many redirects")
+
+
+async def _async_error(url, response, reason):
+    body = await response.read()
+    response.close()
+    return urllib.error.HTTPError(
+        url, response.status, reason, response.headers, io.BytesIO(body)
+    )
+
+
+# What a failed connection, read or write can raise.
+_ASYNC_ERRORS = (
+    OSError,
+    ValueError,
+    asyncio.TimeoutError,
+    asyncio.IncompleteReadError,
+    asyncio.LimitOverrunError,
+)
+
+
+async def _async_request(method, url, headers, timeout):
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        raise urllib.error.URLError("unknown url type: %s" % parts.scheme)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    lines = ["%s %s HTTP/1.1" % (method, path), "Host: %s" % parts.netloc]
+    for key, value in headers.items():
+        if key.lower() not in ("host", "connection"):
+            lines.append("%s: %s" % (key, value))
+    lines.append("Connection: close")
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                parts.hostname,
+                parts.port or (443 if parts.scheme == "https" else 80),
+                ssl=ssl.create_default_context() if parts.scheme == "https" else None,
+            ),
+            timeout,
+        )
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await asyncio.wait_for(writer.drain(), timeout)
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+        status_line, _, header_block = head.partition(b"\r\n")
+        _, status, *reason = status_line.decode("latin-1").split(None, 2)
+        status = int(status)
+    except _ASYNC_ERRORS as e:
+        if writer is not None:
+            writer.close()
+        raise urllib.error.URLError(e)
+    headers = email.parser.BytesParser(_class=http.client.HTTPMessage).parsebytes(
+        header_block
+    )
+    return AsyncResponse(
+        reader, writer, url, status, "".join(reason), headers, method, timeout
+    )
+
+
+class AsyncResponse(object):
+    """
+    A response read with asyncio streams. The body may be delimited by
+    Content-Length, chunked, or run until the connection is closed.
+    """
+
+    def __init__(self, reader, writer, url, status, reason, headers, method, timeout):
+        self._reader = reader
+        self._writer = writer
+        self._timeout = timeout
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self._chunked = "chunked" in headers.get("Transfer-Encoding", "").lower()
+        self._chunk_left = None
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            self._length = 0
+        elif self._chunked or headers.get("Content-Length") is None:
+            self._length = None
+        else:
+            self._length = int(headers["Content-Length"])
+        self._done = False
+
+    async def read(self, amt=None):
+        if amt is None:
+            chunks = []
+            while True:
+                data = await self.read(io.DEFAULT_BUFFER_SIZE)
+                if not data:
+                    return b"".join(chunks)
+                chunks.append(data)
+        try:
+            return await asyncio.wait_for(self._read(amt), self._timeout)
+        except _ASYNC_ERRORS as e:
+            self.close()
+            raise urllib.error.URLError(e)
+
+    async def _read(self, amt):
+        if self._done:
+            return b""
+        if self._chunked:
+            return await self._read_chunked(amt)
+        if self._length is None:
+            data = await self._reader.read(amt)
+        elif self._length:
+            data = await self._reader.read(min(amt, self._length))
+            if not data:
+                raise asyncio.IncompleteReadError(b"", self._length)
+            self._length -= len(data)
+        else:
+            data = b""
+        if not data:
+            self._done = True
+        return data
+
+    async def _read_chunked(self, amt):
+        if not self._chunk_left:
+            if self._chunk_left == 0:
+                # The line break that follows each chunk.
+                await self._reader.readexactly(2)
+            line = await self._reader.readline()
+            self._chunk_left = int(line.split(b";")[0].strip(), 16)
+            if self._chunk_left == 0:
+                # Skip any trailers.
+                while (await self._reader.readline()).strip():
+                    pass
+                self._done = True
+                return b""
+        data = await self._reader.read(min(amt, self._chunk_left))
+        if not data:
+            raise asyncio.IncompleteReadError(b"", self._chunk_left)
+        self._chunk_left -= len(data)
+        return data
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.status
+
+    def close(self):
+        self._writer.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, typ, value, traceback):
+        self.close()
@@ -1,101 +1,1558 @@
 # A basic way of caching files associated with URLs
 
+import contextlib
+import gzip
+import hashlib
+import heapq
+import itertools
 import json
+import lzma
 import os
+import random
 import shutil
 import socket
+import sqlite3
 import tempfile
+import threading
+import time
+import urllib.error
 import urllib.request
-from datetime import datetime, timezone
+import zlib
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+import xbmc
 
 from . import utilities
+from .circuitbreaker import CircuitBreaker
+from .filelock import FileLock
+from .negativecache import NegativeCache
+from .ratelimit import RateLimiter
 
 throwaway = utilities.strptime("20170101", "%Y%m%d")
 
+# A resource downloaded to the cache folder but not yet in the index.
+Download = namedtuple("Download", "filename etag last_modified digests")
 
-class URLCache(object):
-    TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
-    def __init__(self, folder):
-        self._folder = os.path.join(folder, "cache")
-        self._file = os.path.join(folder, "cache.json")
+def _expires(entry):
+    # The expiry of an entry in seconds since the epoch. Entries written
+    # before expiries were kept as numbers only have the formatted time.
+    try:
+        return entry["expires"]
+    except KeyError:
+        return utilities.isoparse(entry["expiry"]).timestamp()
 
-    def __enter__(self):
-        if not os.path.exists(self._folder):
-            os.makedirs(self._folder)
+
+def _size(entry):
+    # The size of an entry's resource in bytes, as recorded when it was
+    # downloaded. Entries written before sizes were recorded count as 0.
+    return 0 if entry is None else entry.get("size", 0)
+
+
+class JSONIndex(dict):
+    """
+    The original cache index: a dictionary of url -> entry that is
+    loaded from, and saved to, a json file. The file is only rewritten
+    when the index has actually been modified, and then only the
+    modified entries are merged into whatever is on disk, so that
+    processes sharing the file don't overwrite each other's entries.
+    """
+
+    def __init__(self, path):
+        super(JSONIndex, self).__init__()
+        self._path = path
+        self._lock = FileLock(path + ".lock")
+        self._changes = {}
+        # (expires, url) for each entry, so that flush needn't look at them
+        # all. Entries since replaced or removed are dropped as they surface.
+        self._expiries = []
+        # The total size of the entries, kept up to date as they change.
+        self._bytes = 0
+        self.dirty = False
+        self.corrupt = False
+
+    def _put(self, url, entry):
+        self._bytes += _size(entry) - _size(self.get(url))
+        super(JSONIndex, self).__setitem__(url, entry)
+
+    def _pop(self, url):
+        self._bytes -= _size(super(JSONIndex, self).pop(url, None))
+
+    def __setitem__(self, url, entry):
+        self._put(url, entry)
+        heapq.heappush(self._expiries, (_expires(entry), url))
+        self._changes[url] = entry
+        self.dirty = True
+
+    def __delitem__(self, url):
+        removed = self[url]
+        self._pop(url)
+        # Remember what was removed, so that an entry downloaded
+        # since by another process isn't removed with it.
+        self._changes[url] = Removed(removed)
+        self.dirty = True
+
+    def touch(self, url, entry):
+        """
+        Updates the bookkeeping of an entry, unless another process has
+        replaced the entry by the time the index is saved.
+        """
+        self._put(url, entry)
+        change = self._changes.get(url)
+        if change is None or isinstance(change, Touched):
+            self._changes[url] = Touched(entry)
+        else:
+            self._changes[url] = entry
+        self.dirty = True
+
+    def _read(self):
         try:
-            fyle = open(self._file, "r")
+            fyle = open(self._path, "r")
         except IOError:
             # create the file and try again.
-            open(self._file, "a").close()
-            fyle = open(self._file, "r")
+            open(self._path, "a").close()
+            fyle = open(self._path, "r")
         try:
-            self._cache = json.load(fyle)
+            return json.load(fyle)
         except ValueError:
-            self._cache = dict()
-        fyle.close()
+            # An empty file is a new index, anything else has been damaged.
+            self.corrupt = fyle.tell() > 0
+            return dict()
+        finally:
+            fyle.close()
+
+    def load(self):
+        super(JSONIndex, self).clear()
+        super(JSONIndex, self).update(self._read())
+        self._reindex()
+        self._changes = {}
+        self.dirty = False
+
+    def _reindex(self):
+        self._expiries = [(_expires(entry), url) for url, entry in self.items()]
+        heapq.heapify(self._expiries)
+        self._bytes = sum(map(_size, self.values()))
+
+    def totals(self):
+        """
+        The total size in bytes, and the number, of the entries.
+        """
+        return self._bytes, len(self)
+
+    def due(self, before):
+        """
+        The (url, entry) pairs that expire before `before`, in seconds
+        since the epoch, soonest first.
+        """
+        due = OrderedDict()
+        while self._expiries and self._expiries[0][0] < before:
+            expires, url = heapq.heappop(self._expiries)
+            entry = self.get(url)
+            if entry is not None and _expires(entry) == expires:
+                due[url] = entry
+        # Entries that are due stay so until they're removed.
+        for url, entry in due.items():
+            heapq.heappush(self._expiries, (_expires(entry), url))
+        return list(due.items())
+
+    def reload(self, url):
+        """
+        Returns the entry for url as currently found on disk,
+        unless it has been modified here.
+        """
+        if url not in self._changes:
+            entry = self._read().get(url)
+            if entry is None:
+                self._pop(url)
+            elif entry != self.get(url):
+                self._put(url, entry)
+                heapq.heappush(self._expiries, (_expires(entry), url))
+        return self.get(url)
+
+    def save(self):
+        if not self.dirty:
+            return
+        with self._lock:
+            cache = self._read()
+            for url, entry in self._changes.items():
+                if isinstance(entry, Removed):
+                    if self._same(cache.get(url), entry.entry):
+                        del cache[url]
+                elif isinstance(entry, Touched):
+                    if self._same(cache.get(url), entry.entry):
+                        cache[url] = entry.entry
+                else:
+                    cache[url] = entry
+            utilities.atomic_write(self._path, json.dumps(cache, indent=2))
+        super(JSONIndex, self).clear()
+        super(JSONIndex, self).update(cache)
+        self._reindex()
+        self._changes = {}
+        self.dirty = False
+
+    @staticmethod
+    def _same(current, entry):
+        # Whether two entries refer to the same download.
+        return current is not None and current["resource"] == entry["resource"]
+
+    def transaction(self):
+        # Changes are only written when the index is saved.
+        return contextlib.nullcontext()
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def erase(path):
+        for suffix in ("", ".lock"):
+            if os.path.isfile(path + suffix):
+                os.remove(path + suffix)
+
+
+class Removed(object):
+    # Marks an entry deleted from a JSONIndex.
+    def __init__(self, entry):
+        self.entry = entry
+
+
+class Touched(object):
+    # Marks an entry whose bookkeeping was updated in a JSONIndex.
+    def __init__(self, entry):
+        self.entry = entry
+
+
+class SQLiteIndex(object):
+    """
+    A cache index held in an sqlite database, running in WAL mode.
+    Lookups are done per url so the whole index is never parsed, and
+    only modified rows are written. Each write is committed straight
+    away, so other processes see it immediately. An existing json
+    index found at `legacy` is imported the first time the database
+    is opened.
+    """
+
+    def __init__(self, path, legacy=None):
+        self._path = path
+        self._legacy = legacy
+        self._db = None
+        self.dirty = False
+        self.corrupt = False
+
+    def load(self):
+        try:
+            self._connect()
+        except sqlite3.OperationalError:
+            # Such as the database being locked by another connection,
+            # which doesn't mean that it is damaged.
+            self.close()
+            raise
+        except sqlite3.DatabaseError:
+            # Start again with an empty database.
+            self.close()
+            self.erase(self._path)
+            self.corrupt = True
+            self._connect()
+        self.dirty = False
+        if self._legacy and os.path.isfile(self._legacy):
+            self._migrate()
+
+    def _connect(self):
+        self._db = sqlite3.connect(self._path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries "
+            "(url TEXT PRIMARY KEY, expiry TEXT NOT NULL, entry TEXT NOT NULL, "
+            "expires REAL, size INTEGER)"
+        )
+        if self._missing_columns():
+            self._upgrade()
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)"
+        )
+
+    # Columns derived from the entries, added to databases created before
+    # them: name, type and how the value is found from an entry.
+    COLUMNS = (("expires", "REAL", _expires), ("size", "INTEGER", _size))
+
+    def _missing_columns(self):
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(entries)")]
+        return [column for column in self.COLUMNS if column[0] not in columns]
+
+    def _upgrade(self):
+        # Another connection may have added the columns since they were
+        # looked for.
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            missing = self._missing_columns()
+            for name, typ, value in missing:
+                self._db.execute(
+                    "ALTER TABLE entries ADD COLUMN {0} {1}".format(name, typ)
+                )
+            for url, entry in self.items() if missing else ():
+                for name, typ, value in missing:
+                    self._db.execute(
+                        "UPDATE entries SET {0} = ? WHERE url = ?".format(name),
+                        (value(entry), url),
+                    )
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def _migrate(self):
+        with FileLock(self._legacy + ".lock"):
+            if not os.path.isfile(self._legacy):
+                return
+            legacy = JSONIndex(self._legacy)
+            legacy.load()
+            self._db.execute("BEGIN")
+            for url, entry in legacy.items():
+                if url not in self:
+                    self[url] = entry
+            self._db.execute("COMMIT")
+            os.remove(self._legacy)
+        self.dirty = False
+
+    def reload(self, url):
+        return self.get(url)
+
+    def __getitem__(self, url):
+        row = self._db.execute(
+            "SELECT entry FROM entries WHERE url = ?", (url,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(url)
+        return json.loads(row[0])
+
+    def get(self, url, default=None):
+        try:
+            return self[url]
+        except KeyError:
+            return default
+
+    def __setitem__(self, url, entry):
+        self._db.execute(
+            "INSERT OR REPLACE INTO entries (url, expiry, entry, expires, size) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (url, entry["expiry"], json.dumps(entry), _expires(entry), _size(entry)),
+        )
+        self.dirty = True
+
+    def touch(self, url, entry):
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            current = self.get(url)
+            if current is not None and current["resource"] == entry["resource"]:
+                self[url] = entry
+        finally:
+            self._db.execute("COMMIT")
+
+    def __delitem__(self, url):
+        cursor = self._db.execute("DELETE FROM entries WHERE url = ?", (url,))
+        if cursor.rowcount == 0:
+            raise KeyError(url)
+        self.dirty = True
+
+    def __contains__(self, url):
+        return (
+            self._db.execute("SELECT 1 FROM entries WHERE url = ?", (url,)).fetchone()
+            is not None
+        )
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def __iter__(self):
+        return iter([row[0] for row in self._db.execute("SELECT url FROM entries")])
+
+    def items(self):
+        return [
+            (url, json.loads(entry))
+            for url, entry in self._db.execute("SELECT url, entry FROM entries")
+        ]
+
+    def due(self, before):
+        """
+        The (url, entry) pairs that expire before `before`, in seconds
+        since the epoch, soonest first.
+        """
+        return [
+            (url, json.loads(entry))
+            for url, entry in self._db.execute(
+                "SELECT url, entry FROM entries WHERE expires < ? ORDER BY expires",
+                (before,),
+            )
+        ]
+
+    def totals(self):
+        """
+        The total size in bytes, and the number, of the entries.
+        """
+        size, count = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0), COUNT(*) FROM entries"
+        ).fetchone()
+        return size, count
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Groups the writes made within it into a single commit.
+        """
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def save(self):
+        self.dirty = False
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    @staticmethod
+    def erase(path):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.isfile(path + suffix):
+                os.remove(path + suffix)
+
+
+class URLCache(object):
+    TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+    REVALIDATE_PERIOD = timedelta(days=1)
+    LOCK_TIMEOUT = 60
+    CHUNK_SIZE = 64 * 1024
+    # How often the last access time of an entry is written to the index.
+    ACCESS_RESOLUTION = timedelta(minutes=10)
+    RECOVERY_INTERVAL = timedelta(days=1)
+    # Files younger than this may be downloads still in progress.
+    ORPHAN_AGE = timedelta(hours=1)
+
+    def __init__(
+        self,
+        folder,
+        index="json",
+        stale_window=None,
+        memory=None,
+        max_bytes=None,
+        max_entries=None,
+        eviction="lru",
+        checksum=None,
+        max_size=None,
+        compress=None,
+        pool=None,
+        retries=0,
+        backoff=0.5,
+        breaker_threshold=None,
+        breaker_timeout=timedelta(minutes=5),
+        negative_ttls=None,
+        rate_limits=None,
+        rate_reserve=0.1,
+        key=None,
+        shared=None,
+    ):
+        """
+        index: "json" or "sqlite", the backend used to store cache entries.
+        stale_window: if given, a timedelta for which an expired entry may
+        still be returned by get(). The entry is then refreshed in the
+        background once the cache is closed.
+        memory: if given, a DocumentCache that keeps the documents returned
+        by get_json in memory, typically shared by every URLCache opened
+        in a long running process.
+        max_bytes, max_entries: if given, limits on the total size and the
+        number of cached resources. Beyond them, entries are evicted when
+        the cache is flushed, least recently used first or, if eviction
+        is "lfu", least frequently used first.
+        checksum: if given, the name of a hashlib algorithm. The digest
+        of each download is recorded in its entry under that name.
+        max_size: if given, downloads larger than this many bytes are
+        abandoned with a DownloadTooLargeError.
+        compress: None, "gzip" or "lzma". Resources are stored compressed
+        with the given format, and must then be read with open_resource.
+        get_json does so itself.
+        pool: if given, a transport.ConnectionPool through which requests
+        are made, so that connections are kept open between them.
+        retries: how many times a request that timed out, could not
+        connect or got a 429 or 5xx response is tried again. The n-th
+        retry waits a random time of up to backoff * 2 ** n seconds.
+        breaker_threshold: if given, the number of consecutive failed
+        fetches after which requests to a host are suspended for
+        breaker_timeout. Meanwhile its cached resources are served,
+        however old, and are not flushed. Expired resources are kept
+        for a day, so that there is something to serve.
+        negative_ttls: if given, failed requests are remembered, and
+        for as long as they are get() raises a CachedHTTPError or
+        CachedURLError rather than make the request again. A dict of
+        HTTP status (403), class of statuses ("5xx") or "timeout" to
+        the timedelta for which such failures are remembered.
+        rate_limits: if given, a dict of host to the (calls, timedelta)
+        quotas that requests to it must keep within, as counted by a
+        ratelimit.RateLimiter. Once less than rate_reserve of a quota is
+        left, expired resources are served rather than refreshed. When a
+        quota is used up, a fetch with nothing to serve instead raises
+        RateLimitError.
+        key: if given, a function that maps a url to the key its entry
+        is stored under, such as cachekey.strip_params. Urls with the
+        same key share an entry. It must return a key unchanged.
+        Requests are still made to the url itself.
+        shared: if given, a folder shared by several caches, typically those
+        of different Kodi profiles. Resources are stored there once each,
+        by the sha256 of their content, and linked into this cache's folder.
+        A resource that another cache has already fetched, and that hasn't
+        expired, is used rather than fetched again.
+        """
+        self._base = folder
+        self._folder = os.path.join(folder, "cache")
+        self._file = os.path.join(folder, "cache.json")
+        self._db = os.path.join(folder, "cache.db")
+        self._locks = os.path.join(folder, "locks")
+        self._recovered = os.path.join(self._folder, ".recovered")
+        self._index = index
+        self._stale_window = stale_window
+        self._memory = memory
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+        self._eviction = eviction
+        self._checksum = checksum
+        self._max_size = max_size
+        self._compress = compress
+        self._pool = pool
+        self._retries = retries
+        self._backoff = backoff
+        self._breakers = os.path.join(folder, "breakers.json")
+        if breaker_threshold:
+            self._breaker = CircuitBreaker(
+                self._breakers, breaker_threshold, breaker_timeout
+            )
+        else:
+            self._breaker = None
+        self._failures = os.path.join(folder, "failures.json")
+        if negative_ttls:
+            self._negative = NegativeCache(self._failures, negative_ttls)
+        else:
+            self._negative = None
+        self._quotas = os.path.join(folder, "ratelimit.json")
+        if rate_limits:
+            self._limiter = RateLimiter(self._quotas, rate_limits, rate_reserve)
+        else:
+            self._limiter = None
+        self._key = key or (lambda url: url)
+        self._shared = SharedStore(shared) if shared else None
+        # The digests of each download that are recorded in its entry.
+        self._checksums = set(filter(None, [checksum, self._shared and "sha256"]))
+        self._options = {
+            "index": index,
+            "stale_window": stale_window,
+            "memory": memory,
+            "max_bytes": max_bytes,
+            "max_entries": max_entries,
+            "eviction": eviction,
+            "checksum": checksum,
+            "max_size": max_size,
+            "compress": compress,
+            "pool": pool,
+            "retries": retries,
+            "backoff": backoff,
+            "breaker_threshold": breaker_threshold,
+            "breaker_timeout": breaker_timeout,
+            "negative_ttls": negative_ttls,
+            "rate_limits": rate_limits,
+            "rate_reserve": rate_reserve,
+            "key": key,
+            "shared": shared,
+        }
+        self._pending = []
+        self._refresher = None
+        self.stats = Counter()
+
+    def __enter__(self):
+        # Several caches may be opened at once, from different threads.
+        os.makedirs(self._folder, exist_ok=True)
+        os.makedirs(self._locks, exist_ok=True)
+        if self._index == "sqlite":
+            self._cache = SQLiteIndex(self._db, legacy=self._file)
+        else:
+            self._cache = JSONIndex(self._file)
+        self._cache.load()
+        if self._shared is not None:
+            self._shared.open()
+        if self._cache.corrupt:
+            self.recover()
+        elif self._recovery_due():
+            self.recover(due_only=True)
         return self
 
     def __exit__(self, typ, value, traceback):
-        self.flush()
-        with open(self._file, "w+") as fyle:
-            json.dump(self._cache, fyle, indent=2)
+        try:
+            self.flush()
+            self._cache.save()
+        finally:
+            self._cache.close()
+            if self._shared is not None:
+                self._shared.close()
+        if self.stats["stale"]:
+            utilities.log(
+                "Served {0} stale cache entries".format(self.stats["stale"]),
+                xbmc.LOGDEBUG,
+            )
+        if self._pending:
+            self._refresher = threading.Thread(
+                target=self._refresh, args=(self._pending,)
+            )
+            self._refresher.start()
+            self._pending = []
+
+    def _refresh(self, pending):
+        # Runs in the background, after the cache that served the stale
+        # entries has been saved, so it works on its own copy of the index.
+        with URLCache(self._base, **self._options) as cache:
+            for url, expiry_callback, resource_callback in pending:
+                try:
+                    cache._fetch(url, expiry_callback, resource_callback)
+                    cache.stats["refreshed"] += 1
+                except Exception as e:
+                    utilities.log(
+                        "Background refresh of {0} failed: {1}".format(url, e),
+                        xbmc.LOGWARNING,
+                    )
 
     def remove(self, url):
+        url = self._key(url)
         if url in self._cache:
             entry = self._cache[url]
-            if os.path.isfile(entry["resource"]):
-                os.remove(entry["resource"])
+            self._delete(entry["resource"])
             del self._cache[url]
+            if self._memory is not None:
+                self._memory.invalidate(url)
+
+    def recover(self, due_only=False):
+        """
+        Reconciles the cache folder with the index. Resources that
+        the index has lost are restored from their sidecar metadata,
+        and files that belong to no entry are deleted. Only one cache
+        recovers the folder at a time. If due_only, recovery is skipped
+        when another cache has recovered the folder in the meantime.
+        """
+        with FileLock(self._recovered + ".lock", timeout=self.LOCK_TIMEOUT):
+            if due_only and not self._recovery_due():
+                return
+            self._recover()
+
+    def _recover(self):
+        known = set(
+            os.path.abspath(entry["resource"]) for url, entry in self._cache.items()
+        )
+        now = datetime.now(timezone.utc)
+        for name in os.listdir(self._folder):
+            path = os.path.abspath(os.path.join(self._folder, name))
+            if name.startswith(".") or name.endswith(".meta") or path in known:
+                continue
+            if os.path.isdir(path):
+                continue
+            metadata = self._read_sidecar(path)
+            if metadata is not None:
+                url = metadata.pop("url")
+                metadata["resource"] = path
+                # Another process may have indexed the resource since the
+                # index was loaded.
+                current = self._cache.reload(url)
+                if current is not None and current["resource"] == path:
+                    continue
+                if self._expiry(metadata) + self._grace(metadata) >= now and (
+                    current is None or not os.path.isfile(current["resource"])
+                ):
+                    self._cache[url] = metadata
+                    continue
+            elif not self._orphaned(path):
+                continue
+            self._delete(path)
+        for name in os.listdir(self._folder):
+            path = os.path.join(self._folder, name)
+            if name.endswith(".meta") and not os.path.isfile(path[: -len(".meta")]):
+                if self._orphaned(path):
+                    self._delete_file(path)
+        # Index files left behind by an interrupted save.
+        for name in os.listdir(self._base or "."):
+            path = os.path.join(self._base, name)
+            if name.startswith("cache.json.") and name.endswith(".tmp"):
+                if self._orphaned(path):
+                    self._delete_file(path)
+        if self._shared is not None:
+            self._shared.collect(self.ORPHAN_AGE, self.REVALIDATE_PERIOD)
+        open(self._recovered, "w").close()
+
+    def _orphaned(self, path):
+        # Whether a file is old enough not to be a download in progress.
+        # False if it has been removed meanwhile.
+        try:
+            return self._age(path) >= self.ORPHAN_AGE
+        except FileNotFoundError:
+            return False
+
+    def _recovery_due(self):
+        try:
+            return self._age(self._recovered) >= self.RECOVERY_INTERVAL
+        except OSError:
+            return True
+
+    @staticmethod
+    def _age(path):
+        return datetime.now() - datetime.fromtimestamp(os.path.getmtime(path))
+
+    @staticmethod
+    def _read_sidecar(resource):
+        try:
+            with open(resource + ".meta") as fh:
+                metadata = json.load(fh)
+        except (IOError, ValueError):
+            return None
+        if not isinstance(metadata, dict) or not {"url", "expiry"} <= set(metadata):
+            return None
+        return metadata
+
+    @classmethod
+    def _delete(cls, resource):
+        for path in (resource, resource + ".meta"):
+            cls._delete_file(path)
+
+    @staticmethod
+    def _delete_file(path):
+        # Other caches sharing the folder may have removed it already.
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _store(self, url, entry):
+        """
+        Records entry in the index, along with a sidecar file next
+        to the resource from which the entry can be recovered.
+        """
+        metadata = dict(entry, url=url)
+        del metadata["resource"]
+        utilities.atomic_write(entry["resource"] + ".meta", json.dumps(metadata))
+        self._cache[url] = entry
 
     def flush(self):
-        flushlist = list()
+        """
+        Removes expired entries. Only entries expired by at least the
+        shortest grace period are looked at, and their resources aren't
+        checked for: an entry whose resource has gone is replaced when
+        it is next requested. Entries are then only evicted if the cache
+        has outgrown its limits.
+        """
+        now = time.time()
+        # Hosts that can't be reached, whose entries are kept as fallbacks.
+        held = self._breaker.open_hosts() if self._breaker else set()
+        for url, entry in self._cache.due(now - self._grace({}).total_seconds()):
+            if (
+                _expires(entry) + self._grace(entry).total_seconds() < now
+                and urlsplit(url).netloc not in held
+            ):
+                self.remove(url)
+        if self._over_limits():
+            self.evict()
+
+    def _over_limits(self):
+        # Whether the cache has outgrown its size or count limits, found
+        # from the index's running totals rather than from every entry.
+        if self._max_bytes is None and self._max_entries is None:
+            return False
+        size, count = self._cache.totals()
+        return (self._max_bytes is not None and size > self._max_bytes) or (
+            self._max_entries is not None and count > self._max_entries
+        )
+
+    def evict(self):
+        """
+        Removes entries until the cache is within its size and count limits.
+        """
+        entries = []
+        size = 0
         for url, entry in self._cache.items():
-            if not os.path.isfile(entry["resource"]) or utilities.strptime(
-                entry["expiry"], self.TIME_FORMAT
-            ) < datetime.now(timezone.utc):
-                flushlist.append(url)
-        for url in flushlist:
+            if "size" not in entry:
+                try:
+                    entry["size"] = os.path.getsize(entry["resource"])
+                except OSError:
+                    entry["size"] = 0
+            size += entry["size"]
+            entries.append((url, entry))
+        if self._eviction == "lfu":
+            entries.sort(key=lambda x: (x[1].get("uses", 0), x[1].get("accessed", 0)))
+        else:
+            entries.sort(key=lambda x: x[1].get("accessed", 0))
+        count = len(entries)
+        for url, entry in entries:
+            if (self._max_bytes is None or size <= self._max_bytes) and (
+                self._max_entries is None or count <= self._max_entries
+            ):
+                break
             self.remove(url)
+            self.stats["evicted"] += 1
+            size -= entry["size"]
+            count -= 1
+
+    def _touch(self, url, entry):
+        # Access times are only needed for eviction, and are only
+        # recorded now and again so that cache hits rarely write.
+        if self._max_bytes is None and self._max_entries is None:
+            return
+        now = time.time()
+        if now - entry.get("accessed", 0) < self.ACCESS_RESOLUTION.total_seconds():
+            return
+        entry = dict(entry, accessed=now, uses=entry.get("uses", 0) + 1)
+        self._cache.touch(url, entry)
 
     def erase(self):
-        os.remove(self._file)
+        JSONIndex.erase(self._file)
+        SQLiteIndex.erase(self._db)
+        CircuitBreaker.erase(self._breakers)
+        NegativeCache.erase(self._failures)
+        RateLimiter.erase(self._quotas)
         shutil.rmtree(self._folder)
+        shutil.rmtree(self._locks, ignore_errors=True)
 
     def get(self, url, expiry_callback, resource_callback=None):
         """
         Checks to see if an item is in cache
         """
+        resource = self._lookup(url, expiry_callback, resource_callback)
+        if resource is None:
+            self.stats["miss"] += 1
+            resource = self._fetch(url, expiry_callback, resource_callback)
+        return resource
+
+    def get_many(self, requests, max_workers=4):
+        """
+        As get, for several urls at once. Each request is a tuple of url,
+        expiry_callback and, optionally, resource_callback. Hits are served
+        from the index, then the misses are downloaded concurrently, at most
+        `max_workers` at a time, and recorded in the index together.
+        Returns the filenames in the order requested. If any download
+        fails, the others are still cached and the first error is raised.
+        """
+        requests = [(tuple(request) + (None,))[:3] for request in requests]
+        # Results by key, as urls with the same key share an entry.
+        results = {}
+        misses = {}
+        for url, expiry_callback, resource_callback in requests:
+            key = self._key(url)
+            if key in results:
+                continue
+            results[key] = self._lookup(url, expiry_callback, resource_callback)
+            if results[key] is None:
+                self.stats["miss"] += 1
+                misses[url] = (expiry_callback, resource_callback)
+        if misses:
+            for url, resource in self._fetch_many(misses, max_workers).items():
+                results[self._key(url)] = resource
+        return [results[self._key(url)] for url, _, _ in requests]
+
+    def _lookup(self, url, expiry_callback, resource_callback=None):
+        # The cached resource for url, if it can be served without a fetch.
+        key = self._key(url)
+        entry = self._cache.get(key)
+        if entry is not None and os.path.isfile(entry["resource"]):
+            expiry = self._expiry(entry)
+            now = datetime.now(timezone.utc)
+            if expiry >= now:
+                self.stats["hit"] += 1
+                self._touch(key, entry)
+                return entry["resource"]
+            elif self._stale_window and expiry + self._stale_window >= now:
+                self.stats["stale"] += 1
+                self._touch(key, entry)
+                self._pending.append((url, expiry_callback, resource_callback))
+                return entry["resource"]
+        return None
+
+    def get_json(self, url, expiry_callback, resource_callback=None):
+        """
+        As get, but returns the resource decoded from json. The callbacks
+        are given the decoded document rather than a filename, so that
+        each download is only decoded once.
+        """
+        decode, expiry, resource = self._json_callbacks(
+            url, expiry_callback, resource_callback
+        )
+        return decode(self.get(url, expiry, resource))
+
+    def _json_callbacks(self, url, expiry_callback, resource_callback=None):
+        # Wraps callbacks that take a document as ones that take a filename,
+        # along with the function that decodes each file just once.
+        documents = {}
+
+        def decode(filename):
+            if filename not in documents:
+                if self._memory is None:
+                    documents[filename] = load_json(filename)
+                else:
+                    documents[filename] = self._memory.load(self._key(url), filename)
+            return documents[filename]
+
+        def expiry(filename):
+            return expiry_callback(decode(filename))
+
+        def resource(filename):
+            resource_callback(decode(filename))
+
+        return decode, expiry, resource_callback and resource
+
+    def _fetch(self, url, expiry_callback, resource_callback=None):
+        """
+        Downloads, or revalidates, the resource at url. Only one process
+        at a time fetches a given url; any others wait for it and then
+        use the entry that it stored.
+        """
+        lock = FileLock(self._lockfile(url), timeout=self.LOCK_TIMEOUT)
+        if not lock.acquire():
+            utilities.log("Timed out waiting for {0}".format(url), xbmc.LOGWARNING)
         try:
-            entry = self._cache[url]
-            if not os.path.isfile(entry["resource"]) or utilities.strptime(
-                entry["expiry"], self.TIME_FORMAT
-            ) < datetime.now(timezone.utc):
-                raise InvalidCacheError
-            else:
+            entry = self._current(url)
+            if entry is not None and self._expiry(entry) >= datetime.now(timezone.utc):
+                self.stats["coalesced"] += 1
                 return entry["resource"]
-        except (KeyError, InvalidCacheError):
-            # (src, headers) = urllib.urlretrieve(url)
+            resource = self._adopt(url)
+            if resource is not None:
+                self._cache.save()
+                return resource
+            resource = self._answer(url, entry)
+            if resource is not None:
+                return resource
+            try:
+                download = self._retrieve(url, self._conditions(entry))
+            except (socket.timeout, urllib.error.URLError) as e:
+                if not self._failed(url, e):
+                    raise
+                return self._fallback(url, entry, e)
+            self._succeeded(url)
+            resource = self._record(
+                url, entry, download, expiry_callback, resource_callback
+            )
+            # Waiting processes read the index as soon as the lock is released.
+            self._cache.save()
+            return resource
+        finally:
+            lock.release()
+
+    def _fetch_many(self, misses, max_workers):
+        """
+        As _fetch, for a dict of url -> (expiry_callback, resource_callback).
+        Only the downloads run on the thread pool: the index is read and
+        written on this thread, which holds the lock for every url until
+        the index has been saved.
+        """
+        results = {}
+        entries = {}
+        locks = []
+        errors = []
+        try:
+            # Locks are always taken in the same order, so that processes
+            # fetching overlapping sets of urls don't wait on each other.
+            for url in sorted(misses):
+                lock = FileLock(self._lockfile(url), timeout=self.LOCK_TIMEOUT)
+                if not lock.acquire():
+                    utilities.log(
+                        "Timed out waiting for {0}".format(url), xbmc.LOGWARNING
+                    )
+                locks.append(lock)
+                entry = self._current(url)
+                if entry is not None and self._expiry(entry) >= datetime.now(
+                    timezone.utc
+                ):
+                    self.stats["coalesced"] += 1
+                    results[url] = entry["resource"]
+                    continue
+                resource = self._adopt(url)
+                if resource is not None:
+                    results[url] = resource
+                    continue
+                try:
+                    resource = self._answer(url, entry)
+                except urllib.error.URLError as e:
+                    errors.append(e)
+                    continue
+                if resource is None:
+                    entries[url] = entry
+                else:
+                    results[url] = resource
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    (url, executor.submit(self._retrieve, url, self._conditions(entry)))
+                    for url, entry in entries.items()
+                ]
+            with self._cache.transaction():
+                for url, future in futures:
+                    expiry_callback, resource_callback = misses[url]
+                    try:
+                        try:
+                            download = future.result()
+                        except (socket.timeout, urllib.error.URLError) as e:
+                            if not self._failed(url, e):
+                                raise
+                            results[url] = self._fallback(url, entries[url], e)
+                            continue
+                        self._succeeded(url)
+                        results[url] = self._record(
+                            url,
+                            entries[url],
+                            download,
+                            expiry_callback,
+                            resource_callback,
+                        )
+                    except Exception as e:
+                        errors.append(e)
+            self._cache.save()
+        finally:
+            for lock in locks:
+                lock.release()
+        if errors:
+            raise errors[0]
+        return results
+
+    def _current(self, url):
+        # The entry for url as last saved, provided its resource still exists.
+        entry = self._cache.reload(self._key(url))
+        if entry is None or not os.path.isfile(entry["resource"]):
+            return None
+        return entry
+
+    def _adopt(self, url):
+        """
+        Links in the resource for url from the shared folder, if another
+        cache has fetched it and it hasn't expired. Returns its filename.
+        """
+        if self._shared is None:
+            return None
+        key = self._key(url)
+        entry = self._shared.get(key)
+        if entry is None or self._expiry(entry) < datetime.now(timezone.utc):
+            return None
+        try:
+            resource = self._shared.link(entry["resource"], self._folder)
+        except OSError:
+            # Collected since it was looked up.
+            return None
+        if key in self._cache:
+            self.remove(key)
+        self._store(key, dict(entry, resource=resource, accessed=time.time()))
+        self.stats["shared"] += 1
+        return resource
+
+    def _lockfile(self, url):
+        return os.path.join(
+            self._locks,
+            hashlib.sha1(self._key(url).encode("utf-8")).hexdigest() + ".lock",
+        )
+
+    def _expiry(self, entry):
+        return datetime.fromtimestamp(_expires(entry), timezone.utc)
+
+    def _grace(self, entry):
+        # Entries that can be revalidated are worth keeping beyond their
+        # expiry, so that a refresh is a conditional GET rather than a download.
+        # Likewise stale entries are kept for as long as they can be served,
+        # and with a circuit breaker, kept to fall back on.
+        grace = self._stale_window or timedelta(0)
+        if entry.get("etag") or entry.get("last_modified") or self._breaker:
+            grace = max(grace, self.REVALIDATE_PERIOD)
+        return grace
+
+    @staticmethod
+    def _conditions(entry):
+        """
+        The headers that make the request for an expired entry conditional,
+        so that if the resource is unchanged the server need not send it.
+        """
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def _retrieve(self, url, headers=None):
+        """
+        Downloads the resource at url to a new file in the cache folder.
+        The index is not used, so this is safe to call from any thread.
+        Returns a Download, or None if the request was conditional and
+        the server reported the resource as unmodified. Transient
+        failures are retried as configured.
+        """
+        for attempt in itertools.count():
             try:
-                req = urllib.request.Request(url, None, {"User-Agent": "Mozilla/5.0"})
+                return self._download(url, headers)
+            except (socket.timeout, urllib.error.URLError) as e:
+                if attempt >= self._retries or not self._retry(url, e):
+                    raise
+                time.sleep(self._delay(attempt))
+
+    def _retry(self, url, error):
+        # Whether to try a failed request again. Retries count against
+        # the rate limits like any other request.
+        return self._transient(error) and (
+            self._limiter is None or self._limiter.acquire(urlsplit(url).netloc)
+        )
+
+    @staticmethod
+    def _transient(error):
+        # Whether a failed request is worth trying again.
+        if isinstance(error, urllib.error.HTTPError):
+            return error.code == 429 or error.code >= 500
+        return True
+
+    def _delay(self, attempt):
+        # Exponential backoff, with full jitter so that clients that
+        # failed together don't all retry together.
+        return random.uniform(0, self._backoff * 2**attempt)
+
+    def remaining(self, url):
+        """
+        How many more requests can be made to the host of url without
+        exceeding its rate limits, or None if it has no limits.
+        """
+        if self._limiter is None:
+            return None
+        return self._limiter.remaining(urlsplit(url).netloc)
+
+    def _answer(self, url, entry):
+        """
+        Answers a fetch without making a request, if the host's breaker
+        is open, the url failed recently or the host's quota is running
+        out. Returns the resource to serve, or None if the request should
+        be made, in which case it has been counted against the quota.
+        """
+        host = urlsplit(url).netloc
+        if self._breaker is not None and not self._breaker.allow(host):
+            return self._fallback(url, entry, CircuitOpenError("Circuit open", url))
+        error = self._negative and self._negative.get(url)
+        if error:
+            self.stats["negative"] += 1
+            raise error
+        if self._limiter is not None:
+            if entry is not None and self._limiter.low(host):
+                self.stats["throttled"] += 1
+                return self._fallback(url, entry, RateLimitError("Quota low", url))
+            if not self._limiter.acquire(host):
+                self.stats["throttled"] += 1
+                return self._fallback(url, entry, RateLimitError("Quota used up", url))
+        return None
+
+    def _succeeded(self, url):
+        if self._breaker is not None:
+            self._breaker.success(urlsplit(url).netloc)
+
+    def _failed(self, url, error):
+        """
+        Records a failed request. Returns True if its host's breaker
+        is open, so that a cached resource should be served instead.
+        """
+        if self._negative is not None:
+            self._negative.add(url, error)
+        if self._breaker is None or not self._transient(error):
+            return False
+        return self._breaker.failure(urlsplit(url).netloc)
+
+    def _fallback(self, url, entry, error):
+        # When a request can't or shouldn't be made, serves the last
+        # resource fetched from url regardless of its expiry, if there is one.
+        if entry is None:
+            raise error
+        utilities.log(
+            "Serving cached {0} ({1})".format(url, getattr(error, "reason", error)),
+            xbmc.LOGWARNING,
+        )
+        self.stats["fallback"] += 1
+        return entry["resource"]
+
+    def _download(self, url, headers=None):
+        # (src, headers) = urllib.urlretrieve(url)
+        conditional = bool(headers)
+        try:
+            req = self._request(url, headers)
+            if self._pool is None:
                 response = urllib.request.urlopen(req)
-            except (socket.timeout, urllib.request.URLError) as e:
-                e.args = (str(e), url)
+            else:
+                response = self._pool.urlopen(req)
+        except urllib.error.HTTPError as e:
+            if conditional and e.code == 304:
+                return None
+            e.args = (str(e), url)
+            raise
+        except (socket.timeout, urllib.error.URLError) as e:
+            e.args = (str(e), url)
+            raise
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        tmp = tempfile.NamedTemporaryFile(
+            dir=self._folder, delete=False, suffix=COMPRESSION_SUFFIXES[self._compress]
+        )
+        try:
+            with response, tmp, self._writer(tmp) as fh:
+                digests = self._stream(url, response, fh)
+        except BaseException:
+            os.remove(tmp.name)
+            raise
+        return Download(tmp.name, etag, last_modified, digests)
+
+    @staticmethod
+    def _request(url, headers=None):
+        headers = dict(headers or {})
+        headers["User-Agent"] = "Mozilla/5.0"
+        headers["Accept-Encoding"] = "gzip, deflate"
+        return urllib.request.Request(url, None, headers)
+
+    def _record(self, url, entry, download, expiry_callback, resource_callback=None):
+        """
+        Stores the result of _retrieve in the index. If the resource was
+        unmodified then only the expiry of the existing entry is updated.
+        Returns the filename of the cached resource.
+        """
+        url = self._key(url)
+        if download is None:
+            entry = dict(entry)
+            self._expire(entry, expiry_callback(entry["resource"]))
+            self._store(url, entry)
+            self._publish(url, entry)
+            return entry["resource"]
+        expiry = expiry_callback(download.filename)
+        if resource_callback:
+            resource_callback(download.filename)
+        entry = {
+            "resource": download.filename,
+            "size": os.path.getsize(download.filename),
+            "accessed": time.time(),
+        }
+        self._expire(entry, expiry)
+        entry.update(download.digests)
+        if download.etag:
+            entry["etag"] = download.etag
+        if download.last_modified:
+            entry["last_modified"] = download.last_modified
+        if self._shared is not None:
+            self._shared.add(download.filename, entry["sha256"])
+        if url in self._cache:
+            self.remove(url)
+        self._store(url, entry)
+        self._publish(url, entry)
+        return download.filename
+
+    def _expire(self, entry, expiry):
+        # The formatted time is for people reading the index.
+        entry["expiry"] = expiry.strftime(self.TIME_FORMAT)
+        entry["expires"] = expiry.timestamp()
+
+    def _publish(self, key, entry):
+        # Lets other caches sharing the folder use this entry.
+        if self._shared is not None and "sha256" in entry:
+            obj = self._shared.path(entry["sha256"], entry["resource"])
+            self._shared.put(key, dict(entry, resource=obj))
+
+    def _writer(self, fh):
+        # Wraps a cache file so that what's written to it is compressed.
+        if self._compress == "gzip":
+            return gzip.GzipFile(filename="", mode="wb", fileobj=fh)
+        elif self._compress == "lzma":
+            return lzma.LZMAFile(fh, "wb")
+        return contextlib.nullcontext(fh)
+
+    def _stream(self, url, response, fh):
+        """
+        Copies the response body to fh a chunk at a time, so that memory
+        use doesn't grow with the size of the resource. Returns a dict of
+        the hex digests of the body.
+        """
+        body = BodyWriter(url, response.headers, fh, self._checksums, self._max_size)
+        while True:
+            data = response.read(self.CHUNK_SIZE)
+            body.write(data)
+            if not data:
+                return body.digests()
+
+
+class BodyWriter(object):
+    """
+    Writes a response body to fh as it arrives, decoding gzip or deflate
+    content encoding on the way, and enforcing max_size. An empty write
+    marks the end of the body.
+    """
+
+    def __init__(self, url, headers, fh, checksums=(), max_size=None):
+        self._url = url
+        self._fh = fh
+        self._max_size = max_size
+        length = headers.get("Content-Length")
+        if max_size and length and int(length) > max_size:
+            raise DownloadTooLargeError("Resource too large", url)
+        encoding = (headers.get("Content-Encoding") or "").lower()
+        if encoding in ("gzip", "x-gzip"):
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            self._decoder = Inflater()
+        else:
+            self._decoder = None
+        self._hashers = dict((name, hashlib.new(name)) for name in checksums)
+        self._size = 0
+
+    def write(self, data):
+        if self._decoder:
+            chunk = self._decoder.decompress(data) if data else self._decoder.flush()
+        else:
+            chunk = data
+        self._size += len(chunk)
+        if self._max_size and self._size > self._max_size:
+            raise DownloadTooLargeError("Resource too large", self._url)
+        for hasher in self._hashers.values():
+            hasher.update(chunk)
+        self._fh.write(chunk)
+
+    def digests(self):
+        return dict(
+            (name, hasher.hexdigest()) for name, hasher in self._hashers.items()
+        )
+
+
+class Inflater(object):
+    """
+    Decodes "deflate" content encoding, which some servers send with
+    a zlib header, as the standard says, and some send without.
+    """
+
+    def __init__(self):
+        self._decoder = None
+
+    def decompress(self, data):
+        if self._decoder is None:
+            self._decoder = zlib.decompressobj()
+            try:
+                return self._decoder.decompress(data)
+            except zlib.error:
+                self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._decoder.decompress(data)
+
+    def flush(self):
+        return self._decoder.flush() if self._decoder else b""
+
+
+class SharedStore(object):
+    """
+    A folder of resources shared by several caches. Each resource is
+    stored once, under objects/, named by the sha256 of its content,
+    and each cache that uses it holds a hard link to it (or, where the
+    filesystem can't link, a copy). A resource is deleted once no cache
+    links to it. An sqlite index records the latest entry fetched by any
+    of the caches for each key.
+    """
+
+    def __init__(self, folder):
+        self._objects = os.path.join(folder, "objects")
+        self._index = SQLiteIndex(os.path.join(folder, "index.db"))
+        self._collecting = os.path.join(folder, "collect.lock")
+
+    def open(self):
+        os.makedirs(self._objects, exist_ok=True)
+        self._index.load()
+
+    def close(self):
+        self._index.close()
+
+    def get(self, key):
+        entry = self._index.get(key)
+        if entry is None or not os.path.isfile(entry["resource"]):
+            return None
+        return entry
+
+    def put(self, key, entry):
+        self._index[key] = entry
+
+    def path(self, digest, filename):
+        # Objects keep the suffix that says how they are compressed.
+        suffix = next(
+            (s for s in COMPRESSION_SUFFIXES.values() if s and filename.endswith(s)),
+            "",
+        )
+        return os.path.join(self._objects, digest[:2], digest + suffix)
+
+    def add(self, filename, digest):
+        """
+        Stores the file at filename as an object, leaving filename linked
+        to it. If the object is already stored, filename is replaced by a
+        link to the existing one.
+        """
+        obj = self.path(digest, filename)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        try:
+            self._link(filename, obj)
+            return
+        except FileExistsError:
+            pass
+        os.remove(filename)
+        self._link(obj, filename)
+
+    def link(self, obj, folder):
+        """
+        Links the object into folder, under a new name.
+        """
+        fd, filename = tempfile.mkstemp(dir=folder, suffix=os.path.splitext(obj)[1])
+        os.close(fd)
+        os.remove(filename)
+        self._link(obj, filename)
+        return filename
+
+    @staticmethod
+    def _link(src, dst):
+        try:
+            os.link(src, dst)
+        except FileExistsError:
+            raise
+        except OSError:
+            if not os.path.isfile(src):
                 raise
-            page = response.read()
-            response.close()
-            tmp = tempfile.NamedTemporaryFile(dir=self._folder, delete=False)
-            tmp.write(page)
-            tmp.close()
-            expiry = expiry_callback(tmp.name)
-            if resource_callback:
-                resource_callback(tmp.name)
-            self._cache[url] = {
-                "resource": tmp.name,
-                "expiry": expiry.strftime(self.TIME_FORMAT),
-            }
-            return tmp.name
+            # No hard links on this filesystem.
+            if os.path.exists(dst):
+                raise FileExistsError(dst)
+            shutil.copyfile(src, dst)
+
+    def collect(self, min_age, grace):
+        """
+        Deletes objects that no cache links to and that are older than
+        min_age, and index entries more than grace past their expiry.
+        Entries whose object has gone are ignored by get. If another
+        cache is already collecting, leaves it to that one.
+        """
+        lock = FileLock(self._collecting)
+        if not lock.acquire(timeout=0):
+            return
+        try:
+            now = time.time()
+            for folder, _, names in os.walk(self._objects):
+                for name in names:
+                    self._collect(
+                        os.path.join(folder, name), now - min_age.total_seconds()
+                    )
+            for key, _ in self._index.due(now - grace.total_seconds()):
+                del self._index[key]
+        finally:
+            lock.release()
+
+    @staticmethod
+    def _collect(obj, before):
+        # Deletes the object if no cache links to it and it's older than
+        # before. It may have been removed already.
+        try:
+            stat = os.stat(obj)
+            if stat.st_nlink <= 1 and stat.st_mtime <= before:
+                os.remove(obj)
+        except FileNotFoundError:
+            pass
+
+
+class DocumentCache(object):
+    """
+    A bounded, least recently used, in memory cache of the documents
+    decoded by URLCache.get_json. Documents are keyed by url and by the
+    cached resource they were decoded from, so a new download is never
+    confused with the document it replaces. Sizes are estimated from
+    the size of the resource decompressed, as compressed json can be a
+    small fraction of the size of the document it decodes to.
+
+    Documents are shared between callers, so must not be modified.
+    """
+
+    def __init__(self, max_bytes=8 * 1024 * 1024, max_entries=32):
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.stats = Counter()
+
+    def load(self, url, filename):
+        key = (url, filename)
+        with self._lock:
+            if key in self._documents:
+                self._documents.move_to_end(key)
+                self.stats["hit"] += 1
+                return self._documents[key][0]
+        self.stats["miss"] += 1
+        # json detects the encoding of bytes for itself.
+        with open_resource(filename) as fh:
+            data = fh.read()
+        size = len(data)
+        document = json.loads(data)
+        if size <= self._max_bytes:
+            with self._lock:
+                self._discard(key)
+                self._documents[key] = (document, size)
+                self.size += size
+                while (
+                    self.size > self._max_bytes
+                    or len(self._documents) > self._max_entries
+                ):
+                    self._discard(next(iter(self._documents)))
+                    self.stats["eviction"] += 1
+        return document
+
+    def invalidate(self, url):
+        with self._lock:
+            for key in [key for key in self._documents if key[0] == url]:
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._documents)
+
+    def _discard(self, key):
+        if key in self._documents:
+            self.size -= self._documents.pop(key)[1]
+
+
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "lzma": ".xz"}
+
+
+def open_resource(filename):
+    """
+    Opens a cached resource for reading as bytes, decompressing it
+    if the cache was asked to store it compressed.
+    """
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rb")
+    elif filename.endswith(".xz"):
+        return lzma.open(filename, "rb")
+    return open(filename, "rb")
+
+
+def load_json(filename):
+    # json detects the encoding of bytes for itself.
+    with open_resource(filename) as fh:
+        return json.load(fh)
 
 
 class InvalidCacheError(Exception):
     pass
+
+
+class CircuitOpenError(urllib.error.URLError):
+    pass
+
+
+class RateLimitError(urllib.error.URLError):
+    pass
+
+
+class DownloadTooLargeError(Exception):
+    pass
@@ -1,8 +1,10 @@
 import math
+import os
+import tempfile
 import time
 import traceback
 from datetime import datetime, timezone
-from functools import wraps
+from functools import lru_cache, wraps
 
 import xbmc
 import xbmcgui
@@ -26,6 +28,36 @@ def strptime(dt, fmt):
     return datetime.fromtimestamp(time.mktime(time.strptime(dt, fmt)), tz=timezone.utc)
 
 
+def isoparse(dt):
+    """
+    Parses a DataPoint time such as "2014-02-04T11:00:00Z", or a date
+    such as "2014-02-04Z", as UTC. This is thread safe, doesn't depend
+    on the local timezone, and is several times quicker than strptime.
+    """
+    return datetime.fromisoformat(dt.rstrip("Z")).replace(tzinfo=timezone.utc)
+
+
+def atomic_write(path, data):
+    """
+    Writes the string data to path by way of a temporary file in the
+    same folder, so that path is never left partially written.
+    """
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".",
+        prefix=os.path.basename(path) + ".",
+        suffix=".tmp",
+    )
+    try:
+        with os.fdopen(fd, "w") as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
 def failgracefully(f):
     """
     Function decorator. When a script fails (raises an exception) we
@@ -95,6 +127,7 @@ def f_or_na(f):
     return wrapper
 
 
+@lru_cache(maxsize=256)
 def minutes_as_time(minutes):
     """
     Takes an integer number of minutes and returns it
@@ -6,7 +6,6 @@ the user. On successful selection internal addon setting
 is set.
 """
 
-import json
 from datetime import datetime, timedelta
 from operator import itemgetter
 from urllib.error import HTTPError
@@ -23,6 +22,7 @@ from metoffice.constants import (
     FORECAST_SITELIST_URL,
     GEOIP_PROVIDERS,
     OBSERVATION_SITELIST_URL,
+    URLCACHE_OPTIONS,
 )
 from metoffice.utilities import gettext as _
 
@@ -35,10 +35,8 @@ def get_geolocation(provider: dict):
     url = provider["url"]
 
     utilities.log("Fetching location from '%s'" % url)
-    with urlcache.URLCache(ADDON_DATA_PATH) as cache:
-        filename = cache.get(url, lambda x: datetime.now() + timedelta(hours=1))
-    with open(filename) as fh:
-        data = json.load(fh)
+    with urlcache.URLCache(ADDON_DATA_PATH, **URLCACHE_OPTIONS) as cache:
+        data = cache.get_json(url, lambda x: datetime.now() + timedelta(hours=1))
 
     # Transform the data.
     # The "latitude" and "longitude" values are intended to provide
@@ -51,14 +49,14 @@ def get_geolocation(provider: dict):
 
 @utilities.xbmcbusy
 def getsitelist(location, text=""):
-    with urlcache.URLCache(ADDON_DATA_PATH) as cache:
+    with urlcache.URLCache(ADDON_DATA_PATH, **URLCACHE_OPTIONS) as cache:
         url = {
             "ForecastLocation": FORECAST_SITELIST_URL,
             "ObservationLocation": OBSERVATION_SITELIST_URL,
         }[location]
         utilities.log("Fetching %s site list from the Met Office..." % location)
         try:
-            filename = cache.get(url, lambda x: datetime.now() + timedelta(weeks=1))
+            data = cache.get_json(url, lambda x: datetime.now() + timedelta(weeks=1))
         except HTTPError:
             dialog.ok(
                 _("Error fetching site list" % location),
@@ -70,8 +68,6 @@ def getsitelist(location, text=""):
                 xbmc.LOGERROR,
             )
             raise
-        with open(filename, encoding="utf-8") as fh:
-            data = json.load(fh)
         sitelist = data["Locations"]["Location"]
         if text:
             sitelist[:] = filter(
@@ -0,0 +1,147 @@
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import threading
+import unittest
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from metoffice import asyncurlcache, urlcache
+from metoffice.filelock import FileLock
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(__file__), "results")
+BODY = json.dumps({"hello": "world"}).encode("utf-8")
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.headers.get("If-None-Match") == '"abc"':
+            self.server.requests[-1] += " (conditional)"
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = BODY
+        self.send_response(200)
+        self.send_header("ETag", '"abc"')
+        if self.path == "/gzip":
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def tomorrow(x):
+    return datetime.now() + timedelta(days=1)
+
+
+class TestAsyncURLCache(unittest.TestCase):
+    def setUp(self):
+        super(TestAsyncURLCache, self).setUp()
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+
+    def test_get(self):
+        url = self.url + "/data"
+
+        async def get():
+            async with asyncurlcache.AsyncURLCache(RESULTS_FOLDER) as cache:
+                filename = await cache.get(url, tomorrow)
+                self.assertEqual(filename, await cache.get(url, tomorrow))
+                self.assertEqual(1, cache.stats["hit"])
+                return filename
+
+        filename = asyncio.run(get())
+        self.assertEqual(["/data"], self.server.requests)
+        with open(filename, "rb") as fh:
+            self.assertEqual(BODY, fh.read())
+
+        # The entry is shared with the synchronous cache.
+        with urlcache.URLCache(RESULTS_FOLDER) as cache:
+            self.assertEqual(filename, cache.get(url, tomorrow))
+            self.assertEqual('"abc"', cache._cache[url]["etag"])
+
+    def test_get_many(self):
+        urls = [self.url + "/data?%d" % i for i in range(5)] + [self.url + "/gzip"]
+
+        async def get_many():
+            async with asyncurlcache.AsyncURLCache(
+                RESULTS_FOLDER, index="sqlite", compress="gzip"
+            ) as cache:
+                return await cache.get_many(
+                    [(url, tomorrow) for url in urls], max_workers=2
+                )
+
+        filenames = asyncio.run(get_many())
+        self.assertEqual(6, len(set(filenames)))
+        self.assertEqual(6, len(self.server.requests))
+        for filename in filenames:
+            self.assertEqual({"hello": "world"}, urlcache.load_json(filename))
+
+    def test_get_json_revalidated(self):
+        url = self.url + "/data"
+
+        async def get_json(expiry_callback):
+            async with asyncurlcache.AsyncURLCache(RESULTS_FOLDER) as cache:
+                return await cache.get_json(url, expiry_callback)
+
+        document = asyncio.run(get_json(lambda x: datetime.now() - timedelta(hours=1)))
+        self.assertEqual({"hello": "world"}, document)
+        # The expired entry is revalidated rather than downloaded again.
+        self.assertEqual(document, asyncio.run(get_json(tomorrow)))
+        self.assertEqual(["/data", "/data (conditional)"], self.server.requests)
+
+    def test_loop_not_blocked(self):
+        # Waiting on the quotas, locked by another process, holds up only
+        # the fetch.
+        url = self.url + "/data"
+        host = "127.0.0.1:%d" % self.server.server_address[1]
+        lock = FileLock(os.path.join(RESULTS_FOLDER, "ratelimit.json.lock"))
+        ticks = []
+
+        async def tick():
+            while True:
+                ticks.append(None)
+                await asyncio.sleep(0.01)
+
+        async def get():
+            async with asyncurlcache.AsyncURLCache(
+                RESULTS_FOLDER, rate_limits={host: [(10, timedelta(minutes=1))]}
+            ) as cache:
+                ticker = asyncio.ensure_future(tick())
+                asyncio.get_running_loop().call_later(0.3, lock.release)
+                filename = await cache.get(url, tomorrow)
+                ticker.cancel()
+                return filename
+
+        self.assertTrue(lock.acquire())
+        try:
+            filename = asyncio.run(get())
+        finally:
+            lock.release()
+        self.assertTrue(os.path.isfile(filename))
+        self.assertGreater(len(ticks), 10)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(RESULTS_FOLDER)
+        super(TestAsyncURLCache, self).tearDown()
+
+
+if __name__ == "__main__":
+    unittest.main()
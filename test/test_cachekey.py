@@ -0,0 +1,23 @@
+from unittest import TestCase
+
+from metoffice.cachekey import strip_params
+
+
+class TestCacheKey(TestCase):
+    def test_strip_params(self):
+        key = strip_params("key")
+        url = (
+            "http://datapoint.metoffice.gov.uk/public/data/val/wxfcs/all/json/"
+            "310069?res=daily&key=12345"
+        )
+        stripped = (
+            "http://datapoint.metoffice.gov.uk/public/data/val/wxfcs/all/json/"
+            "310069?res=daily"
+        )
+        self.assertEqual(stripped, key(url))
+        self.assertEqual(stripped, key(stripped))
+        self.assertEqual("http://www.xbmc.org/", key("http://www.xbmc.org/?key="))
+        # Urls without the parameters are left as they are.
+        self.assertEqual(
+            "http://www.xbmc.org/?a=b c", key("http://www.xbmc.org/?a=b c")
+        )
@@ -0,0 +1,53 @@
+import os
+import shutil
+from datetime import timedelta
+from unittest import TestCase
+from unittest.mock import patch
+
+from metoffice.circuitbreaker import CircuitBreaker
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(__file__), "results")
+BREAKERS = os.path.join(RESULTS_FOLDER, "breakers.json")
+
+
+class TestCircuitBreaker(TestCase):
+    def setUp(self):
+        super(TestCircuitBreaker, self).setUp()
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+
+    @patch("metoffice.circuitbreaker.time.time")
+    def test_breaker(self, mock_time):
+        mock_time.return_value = 1000
+        breaker = CircuitBreaker(BREAKERS, 2, timedelta(minutes=1))
+        self.assertTrue(breaker.allow("example.com"))
+        self.assertFalse(breaker.failure("example.com"))
+        self.assertTrue(breaker.allow("example.com"))
+        self.assertTrue(breaker.failure("example.com"))
+        self.assertFalse(breaker.allow("example.com"))
+        self.assertTrue(breaker.allow("example.org"))
+
+        # State is shared through the file.
+        other = CircuitBreaker(BREAKERS, 2, timedelta(minutes=1))
+        self.assertEqual({"example.com"}, other.open_hosts())
+
+        # After the timeout one trial request is let through.
+        mock_time.return_value = 1061
+        self.assertTrue(breaker.allow("example.com"))
+        self.assertFalse(other.allow("example.com"))
+        self.assertTrue(breaker.failure("example.com"))
+        mock_time.return_value = 1122
+        self.assertTrue(breaker.allow("example.com"))
+        breaker.success("example.com")
+        self.assertEqual(set(), other.open_hosts())
+        self.assertTrue(other.allow("example.com"))
+
+    def test_erase(self):
+        breaker = CircuitBreaker(BREAKERS, 1, timedelta(minutes=1))
+        breaker.failure("example.com")
+        CircuitBreaker.erase(BREAKERS)
+        self.assertFalse(os.path.exists(BREAKERS))
+        self.assertTrue(breaker.allow("example.com"))
+
+    def tearDown(self):
+        shutil.rmtree(RESULTS_FOLDER)
+        super(TestCircuitBreaker, self).tearDown()
@@ -16,6 +16,22 @@ class TestMain(TestCase):
         self.assertFalse(mock_properties.observationlayer.called)
         self.assertFalse(mock_properties.text.called)
 
+    @patch("default.properties")
+    @patch("default.API_KEY", "12345")
+    def test_fetch(self, mock_properties):
+        """
+        Data is fetched up front, then passed to the functions
+        that set the window properties.
+        """
+        mock_properties.fetch_observation.return_value = "observation"
+        mock_properties.fetch_daily.return_value = "daily"
+        mock_properties.fetch_threehourly.return_value = "threehourly"
+        default.main()
+        mock_properties.observation.assert_called_once_with("observation")
+        mock_properties.daily.assert_called_once_with("daily")
+        mock_properties.threehourly.assert_called_once_with("threehourly")
+        mock_properties.window.publish.assert_called_once_with()
+
     @patch("default.properties")
     @patch("default.API_KEY", "")
     def test_no_api_key(self, mock_properties):
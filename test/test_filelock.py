@@ -0,0 +1,52 @@
+import os
+import shutil
+import threading
+from unittest import TestCase
+
+from metoffice import filelock
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(__file__), "results")
+
+
+class TestFileLock(TestCase):
+    def setUp(self):
+        super(TestFileLock, self).setUp()
+        try:
+            os.mkdir(RESULTS_FOLDER)
+        except OSError:
+            pass
+        self.path = os.path.join(RESULTS_FOLDER, "test.lock")
+
+    def test_acquire(self):
+        lock = filelock.FileLock(self.path)
+        other = filelock.FileLock(self.path)
+        self.assertTrue(lock.acquire())
+        self.assertTrue(lock.locked)
+        self.assertFalse(other.acquire(timeout=0))
+        self.assertFalse(other.locked)
+        lock.release()
+        self.assertFalse(lock.locked)
+        self.assertTrue(other.acquire(timeout=0))
+        other.release()
+
+    def test_context_manager(self):
+        with filelock.FileLock(self.path):
+            with self.assertRaises(filelock.LockTimeoutError):
+                with filelock.FileLock(self.path, timeout=0):
+                    pass
+        with filelock.FileLock(self.path, timeout=0) as lock:
+            self.assertTrue(lock.locked)
+
+    def test_waits(self):
+        lock = filelock.FileLock(self.path)
+        lock.acquire()
+        timer = threading.Timer(0.1, lock.release)
+        timer.start()
+        other = filelock.FileLock(self.path)
+        self.assertTrue(other.acquire(timeout=5))
+        other.release()
+        timer.join()
+
+    def tearDown(self):
+        super(TestFileLock, self).tearDown()
+        shutil.rmtree(RESULTS_FOLDER)
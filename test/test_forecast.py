@@ -0,0 +1,91 @@
+import math
+from unittest import TestCase
+
+from metoffice.forecast import Forecast
+
+DATA = {
+    "SiteRep": {
+        "DV": {
+            "dataDate": "2014-02-04T11:00:00Z",
+            "Location": {
+                "Period": [
+                    {
+                        "value": "2014-02-04Z",
+                        "Rep": [
+                            {"$": "Day", "W": "3", "Dm": "10", "S": "7", "D": "SW"},
+                            {"$": "Night", "W": "7", "Nm": "2.5", "S": "4"},
+                        ],
+                    },
+                    # A single rep is given as an object, not a list.
+                    {
+                        "value": "2014-02-05Z",
+                        "Rep": {"$": "Day", "W": "3", "Dm": "bad", "D": "SW"},
+                    },
+                ]
+            },
+        }
+    }
+}
+
+
+class TestForecast(TestCase):
+    def test_from_json(self):
+        forecast = Forecast.from_json(DATA)
+        self.assertEqual("2014-02-04T11:00:00Z", forecast.issued)
+        self.assertEqual(("2014-02-04Z", "2014-02-05Z"), forecast.dates)
+        self.assertEqual(3, len(forecast))
+        self.assertEqual(["10", None, "bad"], [rep.get("Dm") for rep in forecast])
+        self.assertEqual("2.5", forecast[1].get("Nm"))
+        self.assertEqual("na", forecast[1].get("D", "na"))
+        self.assertEqual("2014-02-05Z", forecast[-1].get("value"))
+        self.assertEqual("n/a", forecast[0].get("Unknown", "n/a"))
+        self.assertEqual(7.0, forecast[0].number("S"))
+        self.assertTrue(math.isnan(forecast[2].number("S")))
+        with self.assertRaises(IndexError):
+            forecast[3]
+
+    def test_single_period(self):
+        data = {
+            "SiteRep": {
+                "DV": {
+                    "dataDate": "2014-02-04T11:00:00Z",
+                    "Location": {
+                        "Period": {"value": "2014-02-04Z", "Rep": {"T": "-1.5"}}
+                    },
+                }
+            }
+        }
+        forecast = Forecast.from_json(data)
+        self.assertEqual(1, len(forecast))
+        self.assertEqual("-1.5", forecast[0].get("T"))
+
+    def test_rows(self):
+        forecast = Forecast.from_json(DATA)
+        self.assertEqual([0, 2], forecast.rows("$", "Day"))
+        self.assertEqual([0, 1], forecast.periods([0, 2]))
+        self.assertEqual([], forecast.rows("$", "Dusk"))
+
+    def test_columns(self):
+        forecast = Forecast.from_json(DATA, ["W", "D"])
+        # Only the fields asked for are kept, along with each rep's date.
+        self.assertEqual({"W", "D", "value"}, set(forecast.columns))
+        column = forecast.columns["D"]
+        self.assertEqual(["SW", None], column.table)
+        self.assertEqual("H", column.codes.typecode)
+        self.assertEqual([0, 1, 0], list(column.codes))
+        self.assertEqual(
+            ["2014-02-04Z", "2014-02-04Z", "2014-02-05Z"],
+            [rep.get("value") for rep in forecast],
+        )
+        # Any other field is missing.
+        self.assertEqual("na", forecast[0].get("S", "na"))
+        self.assertEqual([], forecast.rows("$", "Day"))
+
+    def test_numbers(self):
+        forecast = Forecast.from_json(DATA)
+        numbers = forecast.columns["Dm"].numbers
+        self.assertEqual("f", numbers.typecode)
+        self.assertEqual(10.0, numbers[0])
+        self.assertTrue(math.isnan(numbers[1]))
+        self.assertTrue(math.isnan(numbers[2]))
+        self.assertEqual("bad", forecast[2].get("Dm"))
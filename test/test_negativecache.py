@@ -0,0 +1,57 @@
+import os
+import shutil
+import socket
+from datetime import timedelta
+from unittest import TestCase
+from unittest.mock import patch
+from urllib import error
+
+from metoffice.negativecache import (
+    CachedHTTPError,
+    CachedURLError,
+    NegativeCache,
+    NegativeCacheError,
+)
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(__file__), "results")
+FAILURES = os.path.join(RESULTS_FOLDER, "failures.json")
+TTLS = {
+    403: timedelta(hours=1),
+    "5xx": timedelta(minutes=5),
+    "timeout": timedelta(minutes=1),
+}
+
+
+class TestNegativeCache(TestCase):
+    def setUp(self):
+        super(TestNegativeCache, self).setUp()
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+
+    @patch("metoffice.negativecache.time.time")
+    def test_get(self, mock_time):
+        mock_time.return_value = 1000
+        cache = NegativeCache(FAILURES, TTLS)
+        url = "http://www.xbmc.org/"
+        self.assertIsNone(cache.get(url))
+        cache.add(url, error.HTTPError(url, 403, "Forbidden", {}, None))
+        e = cache.get(url)
+        self.assertIsInstance(e, CachedHTTPError)
+        self.assertIsInstance(e, error.HTTPError)
+        self.assertEqual(403, e.code)
+
+        # Each kind of failure is remembered for its own time.
+        cache.add(url + "5", error.HTTPError(url, 503, "Unavailable", {}, None))
+        cache.add(url + "t", error.URLError(socket.timeout("timed out")))
+        cache.add(url + "4", error.HTTPError(url, 400, "Bad Request", {}, None))
+        self.assertIsInstance(cache.get(url + "t"), CachedURLError)
+        self.assertIsNone(cache.get(url + "4"))
+        mock_time.return_value = 1061
+        self.assertIsNone(cache.get(url + "t"))
+        self.assertIsInstance(cache.get(url + "5"), NegativeCacheError)
+        mock_time.return_value = 1301
+        self.assertIsNone(cache.get(url + "5"))
+        self.assertIsNotNone(NegativeCache(FAILURES, TTLS).get(url))
+
+    def tearDown(self):
+        shutil.rmtree(RESULTS_FOLDER)
+        super(TestNegativeCache, self).tearDown()
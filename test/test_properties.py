@@ -1,8 +1,10 @@
+import asyncio
+import json
 import os
 import shutil
 from datetime import datetime, timezone
 from unittest import TestCase
-from unittest.mock import Mock, call, patch
+from unittest.mock import AsyncMock, Mock, call, patch
 
 import xbmc
 
@@ -32,6 +34,11 @@ GEOIP = os.path.join(DATA_FOLDER, "ip-api.json")
 EMPTY_FILE = os.path.join(DATA_FOLDER, "empty.json")
 
 
+def load(filename):
+    with open(filename) as fh:
+        return json.load(fh)
+
+
 def mock_get_region(id):
     region_settings = {"tempunit": "C"}
     return region_settings[id]
@@ -118,7 +125,7 @@ class TestProperties(TestCase):
         except OSError:
             pass
 
-    def mock_get(self, url, expiry_callback, resource_callback=None):
+    def mock_get_json(self, url, expiry_callback, resource_callback=None):
         cache = {
             constants.FORECAST_SITELIST_URL: FORECASTSITELIST,
             constants.DAILY_LOCATION_FORECAST_URL: FORECASTDAILY,
@@ -128,13 +135,13 @@ class TestProperties(TestCase):
             constants.HOURLY_LOCATION_OBSERVATION_URL: OBSERVATIONHOURLY,
             constants.GEOIP_PROVIDER["url"]: GEOIP,
         }
-        return cache[url]
+        return load(cache[url])
 
     @patch("metoffice.urlcache.URLCache")
     @patch("metoffice.properties.window")
     def test_observation(self, mock_window, mock_cache):
-        mock_cache.return_value.__enter__.return_value.get = Mock(
-            side_effect=self.mock_get
+        mock_cache.return_value.__enter__.return_value.get_json = Mock(
+            side_effect=self.mock_get_json
         )
 
         properties.observation()
@@ -185,8 +192,8 @@ class TestProperties(TestCase):
     @patch("metoffice.properties.window")
     def test_observation_object_not_list(self, mock_window, mock_cache):
         # Test the cases when reports don't contain list items.
-        mock_cache.return_value.__enter__.return_value.get = Mock(
-            return_value=OBSERVATIONHOURLY2
+        mock_cache.return_value.__enter__.return_value.get_json = Mock(
+            return_value=load(OBSERVATIONHOURLY2)
         )
 
         properties.observation()
@@ -233,8 +240,8 @@ class TestProperties(TestCase):
         )
 
         # Test exception handling when given json without proper keys
-        mock_cache.return_value.__enter__.return_value.get = Mock(
-            return_value=EMPTY_FILE
+        mock_cache.return_value.__enter__.return_value.get_json = Mock(
+            return_value=load(EMPTY_FILE)
         )
         with self.assertRaises(KeyError) as cm:
             properties.observation()
@@ -251,8 +258,8 @@ class TestProperties(TestCase):
     @patch("metoffice.properties.window")
     def test_observation_missing_location(self, mock_window, mock_cache):
         # Test the cases when reports don't contain any location data
-        mock_cache.return_value.__enter__.return_value.get = Mock(
-            return_value=OBSERVATIONHOURLY3
+        mock_cache.return_value.__enter__.return_value.get_json = Mock(
+            return_value=load(OBSERVATIONHOURLY3)
         )
         with self.assertRaises(KeyError) as cm:
             properties.observation()
@@ -266,12 +273,33 @@ class TestProperties(TestCase):
             cm.exception.args,
         )
 
+    @patch("metoffice.asyncurlcache.AsyncURLCache")
+    def test_fetch_observation_async(self, mock_cache):
+        mock_cache.return_value.__aenter__.return_value.get_json = AsyncMock(
+            side_effect=self.mock_get_json
+        )
+        self.assertEqual(
+            load(OBSERVATIONHOURLY),
+            asyncio.run(properties.fetch_observation_async()),
+        )
+
+    @patch("metoffice.urlcache.URLCache")
+    @patch("metoffice.properties.window")
+    def test_observation_prefetched(self, mock_window, mock_cache):
+        # Data that has already been fetched is applied without the cache.
+        properties.observation(load(OBSERVATIONHOURLY))
+        self.assertFalse(mock_cache.called)
+        self.assertTrue(
+            call("Current.Condition", "Cloudy")
+            in mock_window.setProperty.call_args_list
+        )
+
     @patch("metoffice.utilities.TEMPERATUREUNITS", "C")
     @patch("metoffice.urlcache.URLCache")
     @patch("metoffice.properties.window")
     def test_daily(self, mock_window, mock_cache):
-        mock_cache.return_value.__enter__.return_value.get = Mock(
-            side_effect=self.mock_get
+        mock_cache.return_value.__enter__.return_value.get_json = Mock(
+            side_effect=self.mock_get_json
         )
 
         properties.daily()
@@ -391,8 +419,8 @@ class TestProperties(TestCase):
         )
 
         # Test exception handling when given json without proper keys
-        mock_cache.return_value.__enter__.return_value.get = Mock(
-            return_value=EMPTY_FILE
+        mock_cache.return_value.__enter__.return_value.get_json = Mock(
+            return_value=load(EMPTY_FILE)
         )
         with self.assertRaises(KeyError) as cm:
             properties.daily()
@@ -410,8 +438,8 @@ class TestProperties(TestCase):
     @patch("metoffice.properties.window")
     def test_threehourly(self, mock_window, mock_cache):
         # This test is a bit long and cumbersome. TODO: Figure out how to cut it down.
-        mock_cache.return_value.__enter__.return_value.get = Mock(
-            side_effect=self.mock_get
+        mock_cache.return_value.__enter__.return_value.get_json = Mock(
+            side_effect=self.mock_get_json
         )
 
         properties.threehourly()
@@ -1704,8 +1732,8 @@ class TestProperties(TestCase):
         )
 
         # Test exception handling when given json without proper keys
-        mock_cache.return_value.__enter__.return_value.get = Mock(
-            return_value=EMPTY_FILE
+        mock_cache.return_value.__enter__.return_value.get_json = Mock(
+            return_value=load(EMPTY_FILE)
         )
         with self.assertRaises(KeyError) as cm:
             properties.threehourly()
@@ -1730,29 +1758,29 @@ class TestProperties(TestCase):
 
     @patch("metoffice.urlcache.URLCache")
     def test_daily_expiry(self, mock_cache):
-        mock_cache.return_value.__enter__.return_value.get = Mock(
-            side_effect=self.mock_get
+        mock_cache.return_value.__enter__.return_value.get_json = Mock(
+            side_effect=self.mock_get_json
         )
 
-        result = properties.daily_expiry(FORECASTDAILY)
+        result = properties.daily_expiry(load(FORECASTDAILY))
         self.assertEqual(datetime(2014, 2, 24, 15, 30, tzinfo=timezone.utc), result)
 
     @patch("metoffice.urlcache.URLCache")
     def test_threehourly_expiry(self, mock_cache):
-        mock_cache.return_value.__enter__.return_value.get = Mock(
-            side_effect=self.mock_get
+        mock_cache.return_value.__enter__.return_value.get_json = Mock(
+            side_effect=self.mock_get_json
         )
 
-        result = properties.threehourly_expiry(FORECAST3HOURLY)
+        result = properties.threehourly_expiry(load(FORECAST3HOURLY))
         self.assertEqual(datetime(2014, 3, 1, 17, 30, tzinfo=timezone.utc), result)
 
     @patch("metoffice.urlcache.URLCache")
     def test_observation_expiry(self, mock_cache):
-        mock_cache.return_value.__enter__.return_value.get = Mock(
-            side_effect=self.mock_get
+        mock_cache.return_value.__enter__.return_value.get_json = Mock(
+            side_effect=self.mock_get_json
         )
 
-        result = properties.observation_expiry(OBSERVATIONHOURLY)
+        result = properties.observation_expiry(load(OBSERVATIONHOURLY))
         self.assertEqual(datetime(2014, 3, 6, 18, 30, tzinfo=timezone.utc), result)
 
     def tearDown(self):
@@ -0,0 +1,111 @@
+from unittest import TestCase
+from unittest.mock import Mock, call
+
+from metoffice.forecast import Forecast
+from metoffice.propertymap import PropertyMap
+
+
+class TestPropertyMap(TestCase):
+    def test_apply(self):
+        mapping = PropertyMap(
+            [
+                ("Day{0}.Outlook", "W", "na", {"1": "Sunny", "na": "n/a"}.get),
+                ("Daily.{1}.WindSpeed", "S"),
+                ("Daily.{1}.WindDirection", "D", "na", str.lower),
+                ("Daily.{1}.Summary", None, None, lambda rep: "%(W)s/%(S)s" % rep),
+            ]
+        )
+        window = Mock()
+        mapping.apply(window, {"W": "1", "S": "4", "D": "NNW"}, 2)
+        self.assertEqual(
+            [
+                call("Day2.Outlook", "Sunny"),
+                call("Daily.3.WindSpeed", "4"),
+                call("Daily.3.WindDirection", "nnw"),
+                call("Daily.3.Summary", "1/4"),
+            ],
+            window.setProperty.call_args_list,
+        )
+
+        # Missing fields take their defaults.
+        window.reset_mock()
+        mapping.apply(window, {"W": "na", "S": "5"})
+        self.assertEqual(
+            [
+                call("Day0.Outlook", "n/a"),
+                call("Daily.1.WindSpeed", "5"),
+                call("Daily.1.WindDirection", "na"),
+                call("Daily.1.Summary", "na/5"),
+            ],
+            window.setProperty.call_args_list,
+        )
+
+    def test_keys(self):
+        mapping = PropertyMap([("Hourly.{1}.Time", "$")])
+        self.assertEqual(("Hourly.1.Time",), mapping.keys(0))
+        # Keys are only expanded once for each index.
+        self.assertIs(mapping.keys(7), mapping.keys(7))
+
+    def test_apply_rows(self):
+        mapping = PropertyMap(
+            [
+                ("Hourly.{1}.Outlook", "W", "na", {"1": "Sunny", "na": "n/a"}.get),
+                ("Hourly.{1}.WindSpeed", "S", "n/a"),
+                ("Hourly.{1}.Gust", "G", "n/a"),
+                ("Hourly.{1}.Summary", None, None, lambda rep: rep.get("W")),
+            ]
+        )
+        forecast = Forecast(
+            "2014-02-04T11:00:00Z",
+            ["2014-02-04Z"],
+            [{"W": "1", "S": "4"}, {"S": "7"}, {"W": "1", "S": "4"}],
+            [0, 0, 0],
+        )
+        window = Mock()
+        mapping.apply_rows(window, forecast, [2, 1], [5, 6])
+        self.assertCountEqual(
+            [
+                call("Hourly.6.Outlook", "Sunny"),
+                call("Hourly.7.Outlook", "n/a"),
+                call("Hourly.6.WindSpeed", "4"),
+                call("Hourly.7.WindSpeed", "7"),
+                call("Hourly.6.Gust", "n/a"),
+                call("Hourly.7.Gust", "n/a"),
+                call("Hourly.6.Summary", "1"),
+                call("Hourly.7.Summary", None),
+            ],
+            window.setProperty.call_args_list,
+        )
+
+    def test_apply_rows_formatted(self):
+        formatted = []
+
+        def percentage(value):
+            formatted.append(value)
+            return value + "%"
+
+        mapping = PropertyMap([("Hourly.{1}.Precipitation", "Pp", None, percentage)])
+        forecast = Forecast(
+            "2014-02-04T11:00:00Z",
+            ["2014-02-04Z"],
+            [{"Pp": "5"}, {}, {"Pp": "5"}],
+            [0, 0, 0],
+        )
+        window = Mock()
+        # Values only in rows that aren't applied aren't formatted.
+        mapping.apply_rows(window, forecast, [0, 2])
+        self.assertEqual(["5", "5"], formatted)
+        # When every row is, each distinct value is formatted once.
+        mapping = PropertyMap([("Hourly.{1}.Precipitation", "Pp", "0", percentage)])
+        formatted.clear()
+        window.reset_mock()
+        mapping.apply_rows(window, forecast, range(3))
+        self.assertCountEqual(["5", "0"], formatted)
+        self.assertEqual(
+            [
+                call("Hourly.1.Precipitation", "5%"),
+                call("Hourly.2.Precipitation", "0%"),
+                call("Hourly.3.Precipitation", "5%"),
+            ],
+            window.setProperty.call_args_list,
+        )
@@ -0,0 +1,61 @@
+from unittest import TestCase
+from unittest.mock import Mock
+
+from metoffice.propertysink import PropertySink
+
+
+class Window(dict):
+    # Behaves enough like xbmcgui.Window, counting the properties set.
+    def __init__(self):
+        super(Window, self).__init__()
+        self.setProperty = Mock(side_effect=self.__setitem__)
+
+    def getProperty(self, key):
+        return self.get(key, "")
+
+
+class TestPropertySink(TestCase):
+    def setUp(self):
+        super(TestPropertySink, self).setUp()
+        self.window = Window()
+
+    def refresh(self, properties):
+        self.window.setProperty.reset_mock()
+        sink = PropertySink(self.window)
+        for key, value in properties.items():
+            sink.setProperty(key, value)
+        # Nothing is set until the sink is published.
+        self.assertFalse(self.window.setProperty.called)
+        return sink.publish()
+
+    def test_publish(self):
+        properties = {"Current.Condition": "Cloudy", "Current.Temperature": "10"}
+        self.assertEqual(2, self.refresh(properties))
+        self.assertEqual("Cloudy", self.window["Current.Condition"])
+
+        # Only the properties that have changed are set again.
+        self.assertEqual(0, self.refresh(properties))
+        self.assertFalse(self.window.setProperty.called)
+        self.assertEqual(
+            1, self.refresh(dict(properties, **{"Current.Temperature": "11"}))
+        )
+        self.window.setProperty.assert_called_once_with("Current.Temperature", "11")
+
+    def test_publish_window_reset(self):
+        # A window that has lost its properties gets them all again.
+        properties = {"Current.Condition": "Cloudy"}
+        self.refresh(properties)
+        self.window.clear()
+        self.assertEqual(1, self.refresh(properties))
+        self.assertEqual("Cloudy", self.window["Current.Condition"])
+        self.assertEqual(0, self.refresh(properties))
+
+    def test_publish_window_changed(self):
+        # A value set on the window by something else is replaced, even
+        # though it was the same when last published.
+        properties = {"Current.Condition": "Cloudy", "Current.Temperature": "10"}
+        self.refresh(properties)
+        self.window["Current.Condition"] = "Sunny"
+        self.assertEqual(1, self.refresh(properties))
+        self.window.setProperty.assert_called_once_with("Current.Condition", "Cloudy")
+        self.assertEqual("Cloudy", self.window["Current.Condition"])
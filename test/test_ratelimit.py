@@ -0,0 +1,57 @@
+import os
+import shutil
+from datetime import timedelta
+from unittest import TestCase
+from unittest.mock import patch
+
+from metoffice.ratelimit import RateLimiter
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(__file__), "results")
+QUOTAS = os.path.join(RESULTS_FOLDER, "ratelimit.json")
+LIMITS = {"example.com": [(2, timedelta(minutes=1)), (10, timedelta(days=1))]}
+
+
+class TestRateLimiter(TestCase):
+    def setUp(self):
+        super(TestRateLimiter, self).setUp()
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+
+    @patch("metoffice.ratelimit.time.time")
+    def test_acquire(self, mock_time):
+        mock_time.return_value = 1000
+        limiter = RateLimiter(QUOTAS, LIMITS, reserve=0.6)
+        self.assertEqual(2, limiter.remaining("example.com"))
+        self.assertTrue(limiter.acquire("example.com"))
+        self.assertTrue(limiter.low("example.com"))
+        self.assertTrue(limiter.acquire("example.com"))
+        self.assertFalse(limiter.acquire("example.com"))
+
+        # The budget is shared through the file.
+        other = RateLimiter(QUOTAS, LIMITS)
+        self.assertEqual(0, other.remaining("example.com"))
+
+        # Buckets refill over their period.
+        mock_time.return_value = 1030
+        self.assertEqual(1, other.remaining("example.com"))
+        self.assertTrue(other.acquire("example.com"))
+        mock_time.return_value = 1090
+        self.assertEqual(2, other.remaining("example.com"))
+
+        # Hosts without limits are never held back.
+        self.assertIsNone(limiter.remaining("example.org"))
+        self.assertTrue(limiter.acquire("example.org"))
+        self.assertFalse(limiter.low("example.org"))
+
+    @patch("metoffice.ratelimit.time.time")
+    def test_daily(self, mock_time):
+        mock_time.return_value = 1000
+        limiter = RateLimiter(QUOTAS, LIMITS)
+        for i in range(10):
+            mock_time.return_value += 60
+            self.assertTrue(limiter.acquire("example.com"))
+        mock_time.return_value += 60
+        self.assertFalse(limiter.acquire("example.com"))
+
+    def tearDown(self):
+        shutil.rmtree(RESULTS_FOLDER)
+        super(TestRateLimiter, self).tearDown()
@@ -1,3 +1,4 @@
+import json
 import os
 import shutil
 from unittest import TestCase
@@ -13,13 +14,18 @@ FORECASTSITELIST = os.path.join(DATA_FOLDER, "forecastsitelist.json")
 GEOIP = os.path.join(DATA_FOLDER, "ip-api.json")
 
 
-def mock_get(url, callback):
+def load(filename):
+    with open(filename) as fh:
+        return json.load(fh)
+
+
+def mock_get_json(url, callback):
     if url == constants.FORECAST_SITELIST_URL:
-        return FORECASTSITELIST
+        return load(FORECASTSITELIST)
     elif url == constants.GEOIP_PROVIDER["url"]:
-        return GEOIP
+        return load(GEOIP)
     elif url == "www.bad-geo.com":
-        return os.path.join(DATA_FOLDER, "bad-geo.json")
+        return load(os.path.join(DATA_FOLDER, "bad-geo.json"))
     else:
         return None
 
@@ -55,7 +61,9 @@ class TestSetLocation(TestCase):
     def test_getsitelist_without_geolocation(self, mock_addon, mock_cache):
         # Assumes a call to addon.getSetting("GeoLocation")
         mock_addon.getSetting.return_value = "false"
-        mock_cache.return_value.__enter__.return_value.get = Mock(side_effect=mock_get)
+        mock_cache.return_value.__enter__.return_value.get_json = Mock(
+            side_effect=mock_get_json
+        )
         # Same request for forecast location, but with geolocation off
         result = setlocation.getsitelist.__wrapped__("ForecastLocation", "Cairnwell")
         expected = [
@@ -80,7 +88,9 @@ class TestSetLocation(TestCase):
     @patch("setlocation.API_KEY", "123abc")
     def test_main(self, mock_cache, mock_keyboard, mock_dialog, mock_addon):
         # Pontpandy shouldn't be found, and a message should be displayed saying so
-        mock_cache.return_value.__enter__.return_value.get = Mock(side_effect=mock_get)
+        mock_cache.return_value.__enter__.return_value.get_json = Mock(
+            side_effect=mock_get_json
+        )
         mock_keyboard.return_value.getText = Mock(return_value="Pontypandy")
         mock_keyboard.return_value.isConfirmed = Mock(return_value=True)
         setlocation.main("ForecastLocation")
@@ -0,0 +1,137 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+from urllib import error, request
+
+from metoffice import transport
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.peers.add(self.client_address)
+        if self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/data")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path == "/chunked":
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for chunk in (b"hel", b"lo"):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+        elif self.path.startswith("/data"):
+            body = self.headers.get("X-Echo", "hello").encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_response(403)
+            self.send_header("Content-Length", "9")
+            self.end_headers()
+            self.wfile.write(b"Forbidden")
+
+    def log_message(self, *args):
+        pass
+
+
+class TestConnectionPool(TestCase):
+    def setUp(self):
+        super(TestConnectionPool, self).setUp()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.peers = set()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.pool = transport.ConnectionPool()
+
+    def test_urlopen(self):
+        for i in range(3):
+            req = request.Request(self.url + "/data?i=%d" % i, None, {"X-Echo": "hi"})
+            with self.pool.urlopen(req) as response:
+                self.assertEqual(200, response.status)
+                self.assertEqual(b"hi", response.read())
+        # All three requests were made over one connection.
+        self.assertEqual(1, self.pool.connections)
+        self.assertEqual(1, len(self.server.peers))
+
+    def test_unread_response(self):
+        # A connection is only reused once its response has been read.
+        response = self.pool.urlopen(request.Request(self.url + "/data"))
+        response.close()
+        with self.pool.urlopen(request.Request(self.url + "/data")) as response:
+            self.assertEqual(b"hello", response.read())
+        self.assertEqual(2, self.pool.connections)
+
+    def test_redirect(self):
+        with self.pool.urlopen(request.Request(self.url + "/redirect")) as response:
+            self.assertEqual(self.url + "/data", response.geturl())
+            self.assertEqual(b"hello", response.read())
+        self.assertEqual(1, self.pool.connections)
+
+    def test_http_error(self):
+        with self.assertRaises(error.HTTPError) as cm:
+            self.pool.urlopen(request.Request(self.url + "/secret"))
+        self.assertEqual(403, cm.exception.code)
+        self.assertEqual(b"Forbidden", cm.exception.read())
+        with self.pool.urlopen(request.Request(self.url + "/data")) as response:
+            response.read()
+        self.assertEqual(1, self.pool.connections)
+
+    def test_url_error(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.pool.close()
+        with self.assertRaises(error.URLError):
+            self.pool.urlopen(request.Request(self.url + "/data"))
+
+    def test_closed_by_server(self):
+        with self.pool.urlopen(request.Request(self.url + "/data")) as response:
+            response.read()
+        # Drop the idle connection from the server side.
+        for connections in self.pool._idle.values():
+            for connection in connections:
+                connection.sock.shutdown(2)
+        with self.pool.urlopen(request.Request(self.url + "/data")) as response:
+            self.assertEqual(b"hello", response.read())
+        self.assertEqual(2, self.pool.connections)
+
+    def test_async_urlopen(self):
+        async def fetch(path):
+            req = request.Request(self.url + path, None, {"X-Echo": "hi"})
+            async with await transport.async_urlopen(req) as response:
+                return response.geturl(), await response.read()
+
+        async def fetch_all():
+            return await asyncio.gather(
+                fetch("/data"), fetch("/redirect"), fetch("/chunked")
+            )
+
+        self.assertEqual(
+            [
+                (self.url + "/data", b"hi"),
+                (self.url + "/data", b"hi"),
+                (self.url + "/chunked", b"hello"),
+            ],
+            asyncio.run(fetch_all()),
+        )
+
+    def test_async_urlopen_errors(self):
+        with self.assertRaises(error.HTTPError) as cm:
+            asyncio.run(transport.async_urlopen(request.Request(self.url + "/secret")))
+        self.assertEqual(403, cm.exception.code)
+        self.assertEqual(b"Forbidden", cm.exception.read())
+        with self.assertRaises(error.URLError):
+            asyncio.run(transport.async_urlopen(request.Request("http://127.0.0.1:1/")))
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        super(TestConnectionPool, self).tearDown()
@@ -1,15 +1,38 @@
+import gzip
+import hashlib
+import io
 import json
 import os
 import shutil
-import tempfile
+import sqlite3
+import time
 import unittest
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from email.message import Message
 from unittest.mock import Mock
 from urllib import request
 
+from metoffice.cachekey import strip_params
+from metoffice.negativecache import CachedHTTPError, NegativeCacheError
+
 RESULTS_FOLDER = os.path.join(os.path.dirname(__file__), "results")
 
 
+class MockResponse(io.BytesIO):
+    # Behaves enough like the object returned by urlopen.
+    def __init__(self, body=b"", headers=None):
+        super(MockResponse, self).__init__(body)
+        self.headers = Message()
+        for key, value in (headers or {}).items():
+            self.headers[key] = value
+
+
+def mock_response(req):
+    return MockResponse()
+
+
 class TestURLCache(unittest.TestCase):
     def setUp(self):
         # create a disposable area for testing
@@ -78,9 +101,7 @@ class TestURLCache(unittest.TestCase):
 
     def test_remove(self):
         url = "http://www.xbmc.org/"
-        request.urlopen = Mock(
-            side_effect=lambda x: tempfile.NamedTemporaryFile(dir=RESULTS_FOLDER)
-        )
+        request.urlopen = Mock(side_effect=mock_response)
         with self.urlcache.URLCache(RESULTS_FOLDER) as cache:
             filename = cache.get(url, lambda x: datetime.now() + timedelta(hours=1))
             self.assertTrue(
@@ -92,9 +113,7 @@ class TestURLCache(unittest.TestCase):
 
     def test_flush(self):
         url = "http://www.xbmc.org/"
-        request.urlopen = Mock(
-            side_effect=lambda x: tempfile.NamedTemporaryFile(dir=RESULTS_FOLDER)
-        )
+        request.urlopen = Mock(side_effect=mock_response)
         with self.urlcache.URLCache(RESULTS_FOLDER) as cache:
             filename = cache.get(url, lambda x: datetime.now() - timedelta(days=1))
             self.assertTrue(os.path.isfile(filename), "File should exist before flush.")
@@ -102,6 +121,26 @@ class TestURLCache(unittest.TestCase):
             self.assertFalse(os.path.isfile(filename), "File is still in cache.")
             self.assertFalse(url in cache._cache, "Entry is still in cache.")
 
+    def test_flush_due(self):
+        request.urlopen = Mock(side_effect=mock_response)
+        urls = ["http://www.xbmc.org/%d" % i for i in range(3)]
+        for index in ("json", "sqlite"):
+            with self.urlcache.URLCache(RESULTS_FOLDER, index=index) as cache:
+                for days, url in zip((-2, 1, -1), urls):
+                    cache.get(url, Mock(return_value=datetime.now() + timedelta(days)))
+                due = cache._cache.due(time.time())
+                self.assertEqual([urls[0], urls[2]], [url for url, _ in due])
+                # Entries that aren't due aren't looked at, even if their
+                # resource has gone; it is fetched again when next asked for.
+                os.remove(cache._cache[urls[1]]["resource"])
+                cache.flush()
+                self.assertEqual([urls[1]], list(cache._cache))
+                self.assertEqual([], cache._cache.due(time.time()))
+                request.urlopen.reset_mock()
+                cache.get(urls[1], Mock(return_value=datetime.now()))
+                self.assertTrue(request.urlopen.called)
+            cache.erase()
+
     def test_erase(self):
         open(os.path.join(RESULTS_FOLDER, "cache.json"), "a").close()
         os.mkdir(os.path.join(RESULTS_FOLDER, "cache"))
@@ -111,9 +150,7 @@ class TestURLCache(unittest.TestCase):
 
     def test_get(self):
         url = "http://www.xbmc.org/"
-        request.urlopen = Mock(
-            side_effect=lambda x: tempfile.NamedTemporaryFile(dir=RESULTS_FOLDER)
-        )
+        request.urlopen = Mock(side_effect=mock_response)
         mock_expiry_callback = Mock(return_value=datetime.now() + timedelta(days=1))
         mock_resource_callback = Mock()
         with self.urlcache.URLCache(RESULTS_FOLDER) as cache:
@@ -157,6 +194,730 @@ class TestURLCache(unittest.TestCase):
                 cm.exception.args,
             )
 
+    def test_exit_unmodified(self):
+        # A pure cache hit should not rewrite the index.
+        url = "http://www.xbmc.org/"
+        request.urlopen = Mock(side_effect=mock_response)
+        with self.urlcache.URLCache(RESULTS_FOLDER) as cache:
+            cache.get(url, lambda x: datetime.now() + timedelta(hours=1))
+        fyle = os.path.join(RESULTS_FOLDER, "cache.json")
+        mtime = os.stat(fyle).st_mtime_ns
+        os.utime(fyle, ns=(mtime - 10**9, mtime - 10**9))
+        with self.urlcache.URLCache(RESULTS_FOLDER) as cache:
+            cache.get(url, lambda x: datetime.now() + timedelta(hours=1))
+            self.assertFalse(cache._cache.dirty)
+        self.assertEqual(mtime - 10**9, os.stat(fyle).st_mtime_ns)
+
+    def test_sqlite_get(self):
+        url = "http://www.xbmc.org/"
+        request.urlopen = Mock(side_effect=mock_response)
+        with self.urlcache.URLCache(RESULTS_FOLDER, index="sqlite") as cache:
+            filename = cache.get(url, lambda x: datetime.now() + timedelta(hours=1))
+            self.assertTrue(request.urlopen.called)
+        self.assertTrue(os.path.isfile(os.path.join(RESULTS_FOLDER, "cache.db")))
+
+        request.urlopen.reset_mock()
+        with self.urlcache.URLCache(RESULTS_FOLDER, index="sqlite") as cache:
+            self.assertEqual(
+                filename,
+                cache.get(url, lambda x: datetime.now() + timedelta(hours=1)),
+            )
+            self.assertFalse(request.urlopen.called)
+            self.assertFalse(cache._cache.dirty)
+            cache.remove(url)
+            self.assertFalse(url in cache._cache)
+            self.assertFalse(os.path.isfile(filename))
+
+    def test_sqlite_migrate(self):
+        url = "http://www.xbmc.org/"
+        src = os.path.join(RESULTS_FOLDER, "file1.txt")
+        open(src, "w").close()
+        tomorrow = datetime.now() + timedelta(days=1)
+        with open(os.path.join(RESULTS_FOLDER, "cache.json"), "w") as fh:
+            json.dump(
+                {
+                    url: {
+                        "resource": src,
+                        "expiry": tomorrow.strftime(self.urlcache.URLCache.TIME_FORMAT),
+                    }
+                },
+                fh,
+            )
+        request.urlopen = Mock()
+        with self.urlcache.URLCache(RESULTS_FOLDER, index="sqlite") as cache:
+            self.assertEqual(src, cache.get(url, Mock()))
+            self.assertFalse(request.urlopen.called)
+        self.assertFalse(os.path.isfile(os.path.join(RESULTS_FOLDER, "cache.json")))
+
+    def test_sqlite_expires(self):
+        # Databases from before expiries and sizes were kept gain them.
+        url = "http://www.xbmc.org/"
+        yesterday = datetime.now() - timedelta(days=1)
+        entry = {
+            "resource": os.path.join(RESULTS_FOLDER, "file1.txt"),
+            "expiry": yesterday.strftime(self.urlcache.URLCache.TIME_FORMAT),
+        }
+        path = os.path.join(RESULTS_FOLDER, "cache.db")
+        db = sqlite3.connect(path)
+        db.execute(
+            "CREATE TABLE entries "
+            "(url TEXT PRIMARY KEY, expiry TEXT NOT NULL, entry TEXT NOT NULL)"
+        )
+        db.execute(
+            "INSERT INTO entries VALUES (?, ?, ?)",
+            (url, entry["expiry"], json.dumps(entry)),
+        )
+        db.commit()
+        db.close()
+
+        def load(i):
+            index = self.urlcache.SQLiteIndex(path)
+            index.load()
+            try:
+                # The upgrade is only made once.
+                index._upgrade()
+                return index.corrupt, index.due(time.time()), index.totals()
+            finally:
+                index.close()
+
+        # Several connections may upgrade the database at once.
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            results = list(executor.map(load, range(3)))
+        self.assertEqual([(False, [(url, entry)], (0, 1))] * 3, results)
+
+    def test_sqlite_locked(self):
+        # A database that can't be opened for now isn't erased.
+        path = os.path.join(RESULTS_FOLDER, "cache.db")
+        index = self.urlcache.SQLiteIndex(path)
+        index.load()
+        index["http://www.xbmc.org/"] = {"resource": "x", "expiry": "2017-01-01Z"}
+        index.close()
+        index._connect = Mock(side_effect=sqlite3.OperationalError("locked"))
+        with self.assertRaises(sqlite3.OperationalError):
+            index.load()
+        self.assertFalse(index.corrupt)
+        index = self.urlcache.SQLiteIndex(path)
+        index.load()
+        self.assertIn("http://www.xbmc.org/", index)
+        index.close()
+
+    def test_sqlite_erase(self):
+        with self.urlcache.URLCache(RESULTS_FOLDER, index="sqlite"):
+            pass
+        self.urlcache.URLCache(RESULTS_FOLDER, index="sqlite").erase()
+        self.assertFalse(os.path.isfile(os.path.join(RESULTS_FOLDER, "cache.db")))
+        self.assertFalse(os.path.isdir(os.path.join(RESULTS_FOLDER, "cache")))
+
+    def test_get_conditional(self):
+        url = "http://www.xbmc.org/"
+        request.urlopen = Mock(
+            return_value=MockResponse(
+                b"body",
+                {"ETag": '"abc"', "Last-Modified": "Sat, 01 Mar 2014 16:00:00 GMT"},
+            )
+        )
+        with self.urlcache.URLCache(RESULTS_FOLDER) as cache:
+            filename = cache.get(url, lambda x: datetime.now() - timedelta(hours=1))
+            self.assertEqual('"abc"', cache._cache[url]["etag"])
+
+            # Expired entries are revalidated, and a 304 extends the expiry.
+            request.urlopen = Mock(
+                side_effect=request.HTTPError(url, 304, "Not Modified", {}, None)
+            )
+            mock_expiry_callback = Mock(return_value=datetime.now() + timedelta(days=1))
+            self.assertEqual(filename, cache.get(url, mock_expiry_callback))
+            req = request.urlopen.call_args.args[0]
+            self.assertEqual('"abc"', req.get_header("If-none-match"))
+            self.assertEqual(
+                "Sat, 01 Mar 2014 16:00:00 GMT", req.get_header("If-modified-since")
+            )
+            mock_expiry_callback.assert_called_once_with(filename)
+            with open(filename, "rb") as fh:
+                self.assertEqual(b"body", fh.read())
+
+            # Fresh entries are not revalidated.
+            request.urlopen.reset_mock()
+            self.assertEqual(filename, cache.get(url, mock_expiry_callback))
+            self.assertFalse(request.urlopen.called)
+
+    def test_get_stale(self):
+        url = "http://www.xbmc.org/"
+        request.urlopen = Mock(side_effect=mock_response)
+        with self.urlcache.URLCache(
+            RESULTS_FOLDER, stale_window=timedelta(hours=2)
+        ) as cache:
+            filename = cache.get(url, lambda x: datetime.now() - timedelta(hours=1))
+
+        # The expired entry is served straight away and refreshed afterwards.
+        request.urlopen.reset_mock()
+        mock_expiry_callback = Mock(return_value=datetime.now() + timedelta(days=1))
+        with self.urlcache.URLCache(
+            RESULTS_FOLDER, stale_window=timedelta(hours=2)
+        ) as cache:
+            self.assertEqual(filename, cache.get(url, mock_expiry_callback))
+            self.assertFalse(request.urlopen.called)
+            self.assertEqual(1, cache.stats["stale"])
+        cache._refresher.join()
+        self.assertTrue(request.urlopen.called)
+        self.assertTrue(mock_expiry_callback.called)
+
+        with self.urlcache.URLCache(RESULTS_FOLDER) as cache:
+            self.assertNotEqual(filename, cache.get(url, Mock()))
+            self.assertEqual(1, cache.stats["hit"])
+
+        # Beyond the stale window the entry is fetched synchronously.
+        request.urlopen.reset_mock()
+        with self.urlcache.URLCache(
+            RESULTS_FOLDER, stale_window=timedelta(hours=2)
+        ) as cache:
+            cache.remove(url)
+            cache.get(url, lambda x: datetime.now() - timedelta(hours=3))
+            request.urlopen.reset_mock()
+            cache.get(url, lambda x: datetime.now() + timedelta(hours=1))
+            self.assertTrue(request.urlopen.called)
+            self.assertEqual(0, cache.stats["stale"])
+
+    def test_get_coalesced(self):
+        # A cache that misses waits for, and then uses, an entry
+        # stored by another process.
+        url = "http://www.xbmc.org/"
+        request.urlopen = Mock(side_effect=mock_response)
+        with self.urlcache.URLCache(RESULTS_FOLDER) as other:
+            with self.urlcache.URLCache(RESULTS_FOLDER) as cache:
+                filename = other.get(url, lambda x: datetime.now() + timedelta(hours=1))
+                request.urlopen.reset_mock()
+                self.assertEqual(filename, cache.get(url, Mock()))
+                self.assertFalse(request.urlopen.called)
+                self.assertEqual(1, cache.stats["coalesced"])
+
+    def test_get_many(self):
+        urls = ["http://www.xbmc.org/%d" % i for i in range(3)]
+        tomorrow = lambda x: datetime.now() + timedelta(days=1)  # noqa: E731
+        request.urlopen = Mock(side_effect=mock_response)
+        for index in ("json", "sqlite"):
+            with self.urlcache.URLCache(RESULTS_FOLDER, index=index) as cache:
+                hit = cache.get(urls[0], tomorrow)
+                request.urlopen.reset_mock()
+                mock_resource_callback = Mock()
+                filenames = cache.get_many(
+                    [
+                        (urls[0], tomorrow),
+                        (urls[1], tomorrow, mock_resource_callback),
+                        (urls[2], tomorrow),
+                        (urls[1], tomorrow),
+                    ],
+                    max_workers=2,
+                )
+                self.assertEqual(hit, filenames[0])
+                self.assertEqual(filenames[1], filenames[3])
+                self.assertEqual(2, request.urlopen.call_count)
+                mock_resource_callback.assert_called_once_with(filenames[1])
+                self.assertEqual(1, cache.stats["hit"])
+                self.assertEqual(3, cache.stats["miss"])
+            with self.urlcache.URLCache(RESULTS_FOLDER, index=index) as cache:
+                self.assertEqual(
+                    filenames[:3], [cache._cache[url]["resource"] for url in urls]
+                )
+                cache.erase()
+
+    def test_get_many_errors(self):
+        # A failed download doesn't stop the others being cached.
+        url1 = "http://www.xbmc.org/"
+        url2 = "http://www.google.com/"
+
+        def urlopen(req):
+            if req.full_url == url2:
+                raise request.HTTPError(url2, 500, "Server Error", {}, None)
+            return MockResponse(b"body", {"ETag": '"abc"'})
+
+        request.urlopen = Mock(side_effect=urlopen)
+        with self.urlcache.URLCache(RESULTS_FOLDER) as cache:
+            with self.assertRaises(request.HTTPError):
+                cache.get_many(
+                    [
+                        (url1, lambda x: datetime.now() - timedelta(hours=1)),
+                        (url2, Mock()),
+                    ]
+                )
+            self.assertTrue(url1 in cache._cache)
+            self.assertFalse(url2 in cache._cache)
+            filename = cache._cache[url1]["resource"]
+
+            # Expired entries are revalidated.
+            request.urlopen = Mock(
+                side_effect=request.HTTPError(url1, 304, "Not Modified", {}, None)
+            )
+            mock_expiry_callback = Mock(return_value=datetime.now() + timedelta(days=1))
+            self.assertEqual([filename], cache.get_many([(url1, mock_expiry_callback)]))
+            req = request.urlopen.call_args.args[0]
+            self.assertEqual('"abc"', req.get_header("If-none-match"))
+            mock_expiry_callback.assert_called_once_with(filename)
+
+    def test_get_retried(self):
+        url = "http://www.xbmc.org/"
+        request.urlopen = Mock(
+            side_effect=[
+                request.URLError("timed out"),
+                request.HTTPError(url, 503, "Service Unavailable", {}, None),
+                MockResponse(b"body"),
+            ]
+        )
+        with self.urlcache.URLCache(RESULTS_FOLDER, retries=2, backoff=0) as cache:
+            filename = cache.get(url, lambda x: datetime.now() + timedelta(hours=1))
+            self.assertEqual(3, request.urlopen.call_count)
+            with open(filename, "rb") as fh:
+                self.assertEqual(b"body", fh.read())
+
+            # Client errors are not retried.
+            request.urlopen = Mock(
+                side_effect=request.HTTPError(url, 403, "Forbidden", {}, None)
+            )
+            cache.remove(url)
+            with self.assertRaises(request.HTTPError):
+                cache.get(url, Mock())
+            self.assertEqual(1, request.urlopen.call_count)
+
+    def test_get_circuit_breaker(self):
+        url = "http://www.xbmc.org/"
+        options = {"breaker_threshold": 2, "stale_window": None}
+        request.urlopen = Mock(side_effect=mock_response)
+        with self.urlcache.URLCache(RESULTS_FOLDER, **options) as cache:
+            filename = cache.get(url, lambda x: datetime.now() - timedelta(hours=1))
+
+        # The first failure is raised; the second opens the breaker
+        # and the expired resource is served instead.
+        request.urlopen = Mock(side_effect=request.URLError("timed out"))
+        with self.urlcache.URLCache(RESULTS_FOLDER, **options) as cache:
+            with self.assertRaises(request.URLError):
+                cache.get(url, Mock())
+        with self.urlcache.URLCache(RESULTS_FOLDER, **options) as cache:
+            self.assertEqual(filename, cache.get(url, Mock()))
+            self.assertEqual(1, cache.stats["fallback"])
+
+            # While the breaker is open no requests are made.
+            request.urlopen.reset_mock()
+            self.assertEqual(filename, cache.get(url, Mock()))
+            self.assertFalse(request.urlopen.called)
+            with self.assertRaises(self.urlcache.CircuitOpenError):
+                cache.get("http://www.xbmc.org/other", Mock())
+        # Nor is the expired entry flushed.
+        self.assertTrue(os.path.isfile(filename))
+
+    def test_get_negative(self):
+        url = "http://www.xbmc.org/"
+        options = {"negative_ttls": {403: timedelta(hours=1)}}
+        request.urlopen = Mock(
+            side_effect=request.HTTPError(url, 403, "Forbidden", {}, None)
+        )
+        with self.urlcache.URLCache(RESULTS_FOLDER, **options) as cache:
+            with self.assertRaises(request.HTTPError) as cm:
+                cache.get(url, Mock())
+            self.assertNotIsInstance(cm.exception, NegativeCacheError)
+
+        # The failure is answered from the negative cache.
+        request.urlopen.reset_mock()
+        with self.urlcache.URLCache(RESULTS_FOLDER, **options) as cache:
+            with self.assertRaises(CachedHTTPError) as cm:
+                cache.get(url, Mock())
+            self.assertEqual(403, cm.exception.code)
+            self.assertFalse(request.urlopen.called)
+            self.assertEqual(1, cache.stats["negative"])
+            with self.assertRaises(request.HTTPError):
+                cache.get_many([(url, Mock())])
+            self.assertFalse(request.urlopen.called)
+            cache.erase()
+
+    def test_get_rate_limited(self):
+        url = "http://www.xbmc.org/"
+        options = {
+            "rate_limits": {"www.xbmc.org": [(3, timedelta(days=1))]},
+            "rate_reserve": 0.7,
+        }
+        tomorrow = lambda x: datetime.now() + timedelta(days=1)  # noqa: E731
+        request.urlopen = Mock(side_effect=mock_response)
+        with self.urlcache.URLCache(RESULTS_FOLDER, **options) as cache:
+            self.assertEqual(3, cache.remaining(url))
+            filename = cache.get(url, lambda x: datetime.now() - timedelta(hours=1))
+            self.assertEqual(2, cache.remaining(url))
+            self.assertIsNone(cache.remaining("http://www.google.com/"))
+
+            # With the budget low, the expired entry is served instead.
+            request.urlopen.reset_mock()
+            self.assertEqual(filename, cache.get(url, Mock()))
+            self.assertFalse(request.urlopen.called)
+            self.assertEqual(1, cache.stats["throttled"])
+
+            # What isn't cached is still fetched, until the budget is spent.
+            cache.get(url + "1", tomorrow)
+            cache.get(url + "2", tomorrow)
+            self.assertEqual(0, cache.remaining(url))
+            with self.assertRaises(self.urlcache.RateLimitError):
+                cache.get(url + "3", tomorrow)
+            self.assertEqual(2, request.urlopen.call_count)
+
+    def test_get_key(self):
+        url = "http://www.xbmc.org/?res=daily&key=12345"
+        options = {"key": strip_params("key")}
+        tomorrow = lambda x: datetime.now() + timedelta(days=1)  # noqa: E731
+        request.urlopen = Mock(side_effect=mock_response)
+        with self.urlcache.URLCache(RESULTS_FOLDER, **options) as cache:
+            filename = cache.get(url, tomorrow)
+        with open(os.path.join(RESULTS_FOLDER, "cache.json")) as fh:
+            self.assertEqual(["http://www.xbmc.org/?res=daily"], list(json.load(fh)))
+        with open(filename + ".meta") as fh:
+            self.assertNotIn("12345", fh.read())
+
+        # A new API key finds the same entry.
+        request.urlopen.reset_mock()
+        with self.urlcache.URLCache(RESULTS_FOLDER, **options) as cache:
+            self.assertEqual(
+                filename, cache.get("http://www.xbmc.org/?res=daily&key=6789", Mock())
+            )
+            self.assertFalse(request.urlopen.called)
+            cache.remove(url)
+            self.assertFalse(os.path.isfile(filename))
+
+    def test_get_shared(self):
+        url = "http://www.xbmc.org/"
+        shared = os.path.join(RESULTS_FOLDER, "shared")
+        profiles = [os.path.join(RESULTS_FOLDER, name) for name in ("a", "b")]
+        tomorrow = lambda x: datetime.now() + timedelta(days=1)  # noqa: E731
+        request.urlopen = Mock(return_value=MockResponse(b'{"hello": "world"}'))
+        filenames = []
+        for profile in profiles:
+            with self.urlcache.URLCache(
+                profile, compress="gzip", shared=shared
+            ) as cache:
+                filenames.append(cache.get(url, tomorrow))
+        # Fetched once, and stored once.
+        self.assertEqual(1, request.urlopen.call_count)
+        self.assertEqual(1, cache.stats["shared"])
+        self.assertTrue(os.path.samefile(*filenames))
+        digest = hashlib.sha256(b'{"hello": "world"}').hexdigest()
+        obj = os.path.join(shared, "objects", digest[:2], digest + ".gz")
+        self.assertEqual(3, os.stat(obj).st_nlink)
+        self.assertEqual({"hello": "world"}, self.urlcache.load_json(filenames[1]))
+
+        # The object is collected once neither profile uses it.
+        for profile in profiles:
+            with self.urlcache.URLCache(profile, shared=shared) as cache:
+                cache.remove(url)
+                cache.ORPHAN_AGE = timedelta(0)
+                cache.recover()
+        self.assertFalse(os.path.exists(obj))
+
+    def test_collect_concurrent(self):
+        # Profiles recovering at once all collect the shared folder.
+        shared = os.path.join(RESULTS_FOLDER, "shared")
+        store = self.urlcache.SharedStore(shared)
+        store.open()
+        expired = time.time() - 2 * 24 * 60 * 60
+        for i in range(50):
+            obj = store.path("%064x" % i, "")
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            open(obj, "w").close()
+            os.utime(obj, (expired, expired))
+            store.put(str(i), {"resource": obj, "expiry": "", "expires": expired})
+        store.close()
+
+        def recover(profile):
+            with self.urlcache.URLCache(
+                os.path.join(RESULTS_FOLDER, profile), index="sqlite", shared=shared
+            ) as cache:
+                cache.recover()
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(recover, "abcd"))
+        # Collected by whichever got there first.
+        store.open()
+        self.assertEqual(0, len(store._index))
+        store.close()
+        self.assertEqual(
+            [], [names for _, _, names in os.walk(store._objects) if names]
+        )
+
+    def test_exit_merges(self):
+        # Entries written by another process survive our exit.
+        url1 = "http://www.xbmc.org/"
+        url2 = "http://www.google.com/"
+        request.urlopen = Mock(side_effect=mock_response)
+        with self.urlcache.URLCache(RESULTS_FOLDER) as cache:
+            with self.urlcache.URLCache(RESULTS_FOLDER) as other:
+                other.get(url1, lambda x: datetime.now() + timedelta(hours=1))
+            cache.get(url2, lambda x: datetime.now() + timedelta(hours=1))
+        with open(os.path.join(RESULTS_FOLDER, "cache.json")) as fh:
+            cache_contents = json.load(fh)
+        self.assertEqual({url1, url2}, set(cache_contents))
+
+    def test_recover(self):
+        url = "http://www.xbmc.org/"
+        request.urlopen = Mock(side_effect=mock_response)
+        with self.urlcache.URLCache(RESULTS_FOLDER) as cache:
+            filename = cache.get(url, lambda x: datetime.now() + timedelta(hours=1))
+            self.assertTrue(os.path.isfile(filename + ".meta"))
+            orphan = os.path.join(cache._folder, "orphan")
+            recent = os.path.join(cache._folder, "recent")
+        open(orphan, "w").close()
+        open(recent, "w").close()
+        yesterday = (datetime.now() - timedelta(days=1)).timestamp()
+        os.utime(orphan, (yesterday, yesterday))
+
+        # A damaged index is rebuilt from the sidecar files.
+        with open(os.path.join(RESULTS_FOLDER, "cache.json"), "w") as fh:
+            fh.write('{"http://www.xbmc.org/": {"reso')
+        request.urlopen.reset_mock()
+        with self.urlcache.URLCache(RESULTS_FOLDER) as cache:
+            self.assertEqual(filename, cache.get(url, Mock()))
+            self.assertFalse(request.urlopen.called)
+        self.assertFalse(os.path.isfile(orphan))
+        self.assertTrue(os.path.isfile(recent))
+        with open(os.path.join(RESULTS_FOLDER, "cache.json")) as fh:
+            self.assertEqual(filename, json.load(fh)[url]["resource"])
+
+        # Removing an entry removes its sidecar.
+        with self.urlcache.URLCache(RESULTS_FOLDER) as cache:
+            cache.remove(url)
+        self.assertFalse(os.path.isfile(filename))
+        self.assertFalse(os.path.isfile(filename + ".meta"))
+
+    def test_recover_concurrent(self):
+        # Caches opened at once recover the folder one at a time.
+        folder = os.path.join(RESULTS_FOLDER, "cache")
+        os.makedirs(folder)
+        yesterday = (datetime.now() - timedelta(days=1)).timestamp()
+        orphans = [os.path.join(folder, "orphan%d" % i) for i in range(20)]
+        for orphan in orphans:
+            open(orphan, "w").close()
+            open(orphan + ".meta", "w").close()
+            os.utime(orphan, (yesterday, yesterday))
+            os.utime(orphan + ".meta", (yesterday, yesterday))
+
+        def open_cache(i):
+            with self.urlcache.URLCache(RESULTS_FOLDER, index="sqlite"):
+                pass
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            list(executor.map(open_cache, range(3)))
+        self.assertEqual([".recovered", ".recovered.lock"], sorted(os.listdir(folder)))
+
+    def test_recover_indexed(self):
+        # A resource indexed by another process during recovery is kept.
+        url = "http://www.xbmc.org/"
+        request.urlopen = Mock(side_effect=mock_response)
+        with self.urlcache.URLCache(RESULTS_FOLDER, index="sqlite") as cache:
+            filename = cache.get(url, lambda x: datetime.now() + timedelta(hours=1))
+            cache._cache.items = Mock(return_value=[])
+            cache.recover()
+            self.assertTrue(os.path.isfile(filename))
+            self.assertEqual(filename, cache._cache[url]["resource"])
+
+    def test_get_json(self):
+        url = "http://www.xbmc.org/"
+        request.urlopen = Mock(return_value=MockResponse(b'{"dataDate": "x"}'))
+        mock_expiry_callback = Mock(return_value=datetime.now() + timedelta(days=1))
+        mock_resource_callback = Mock()
+        with self.urlcache.URLCache(RESULTS_FOLDER) as cache:
+            data = cache.get_json(url, mock_expiry_callback, mock_resource_callback)
+            self.assertEqual({"dataDate": "x"}, data)
+            mock_expiry_callback.assert_called_once_with(data)
+            mock_resource_callback.assert_called_once_with(data)
+            self.assertEqual(data, cache.get_json(url, mock_expiry_callback))
+            self.assertEqual(1, request.urlopen.call_count)
+
+    def test_get_json_memory(self):
+        url = "http://www.xbmc.org/"
+        request.urlopen = Mock(side_effect=lambda x: MockResponse(b'{"a": 1}'))
+        memory = self.urlcache.DocumentCache()
+        expiry_callback = Mock(return_value=datetime.now() + timedelta(days=1))
+        with self.urlcache.URLCache(RESULTS_FOLDER, memory=memory) as cache:
+            data = cache.get_json(url, expiry_callback)
+        with self.urlcache.URLCache(RESULTS_FOLDER, memory=memory) as cache:
+            self.assertIs(data, cache.get_json(url, expiry_callback))
+        self.assertEqual(1, memory.stats["miss"])
+        self.assertEqual(1, memory.stats["hit"])
+
+        # A new download is decoded afresh.
+        with self.urlcache.URLCache(RESULTS_FOLDER, memory=memory) as cache:
+            cache.remove(url)
+            self.assertEqual(0, len(memory))
+            self.assertIsNot(data, cache.get_json(url, expiry_callback))
+        self.assertEqual(2, memory.stats["miss"])
+
+    def test_document_cache_bounds(self):
+        filename = os.path.join(RESULTS_FOLDER, "document.json")
+        with open(filename, "w") as fh:
+            fh.write('{"a": 1}')
+        memory = self.urlcache.DocumentCache(max_bytes=20, max_entries=3)
+        for url in ("a", "b", "c"):
+            memory.load(url, filename)
+        self.assertEqual(2, len(memory))
+        self.assertEqual(16, memory.size)
+        memory.load("b", filename)
+        self.assertEqual(1, memory.stats["hit"])
+        memory.load("a", filename)
+        self.assertEqual(2, memory.stats["eviction"])
+        memory.clear()
+        self.assertEqual(0, memory.size)
+
+    def test_document_cache_compressed(self):
+        # Sizes are those of the documents, not of the files.
+        document = {"a": "x" * 1000}
+        filename = os.path.join(RESULTS_FOLDER, "document.json.gz")
+        with gzip.open(filename, "wb") as fh:
+            fh.write(json.dumps(document).encode("utf-8"))
+        self.assertLess(os.path.getsize(filename), 100)
+        memory = self.urlcache.DocumentCache(max_bytes=500)
+        self.assertEqual(document, memory.load("a", filename))
+        self.assertEqual(0, len(memory))
+        memory = self.urlcache.DocumentCache()
+        memory.load("a", filename)
+        self.assertEqual(len(json.dumps(document)), memory.size)
+
+    def test_evict(self):
+        request.urlopen = Mock(side_effect=lambda x: MockResponse(b"0123456789"))
+        expiry_callback = Mock(return_value=datetime.now() + timedelta(days=1))
+        urls = ["http://www.xbmc.org/%d" % i for i in range(4)]
+        with self.urlcache.URLCache(
+            RESULTS_FOLDER, max_bytes=25, max_entries=3
+        ) as cache:
+            for i, url in enumerate(urls[:3]):
+                cache.get(url, expiry_callback)
+                cache._cache[url] = dict(cache._cache[url], accessed=i)
+            # A hit marks the first url as recently used.
+            cache.get(urls[0], expiry_callback)
+            cache.flush()
+            self.assertEqual(1, cache.stats["evicted"])
+            self.assertEqual({urls[0], urls[2]}, set(cache._cache))
+
+            cache.get(urls[1], expiry_callback)
+            cache.get(urls[3], expiry_callback)
+            cache._max_bytes = None
+            cache.flush()
+            self.assertEqual(3, len(cache._cache))
+
+    def test_evict_totals(self):
+        # Entries are only looked at once the cache outgrows its limits.
+        request.urlopen = Mock(side_effect=lambda x: MockResponse(b"0123456789"))
+        expiry_callback = Mock(return_value=datetime.now() + timedelta(days=1))
+        urls = ["http://www.xbmc.org/%d" % i for i in range(3)]
+        for index in ("json", "sqlite"):
+            with self.urlcache.URLCache(
+                RESULTS_FOLDER, index=index, max_bytes=25
+            ) as cache:
+                cache.evict = Mock(side_effect=cache.evict)
+                for url in urls[:2]:
+                    cache.get(url, expiry_callback)
+                self.assertEqual((20, 2), cache._cache.totals())
+                cache.flush()
+                self.assertFalse(cache.evict.called)
+                cache.get(urls[2], expiry_callback)
+                cache.flush()
+                self.assertTrue(cache.evict.called)
+                self.assertEqual((20, 2), cache._cache.totals())
+                cache.remove(urls[2])
+                self.assertEqual((10, 1), cache._cache.totals())
+            with self.urlcache.URLCache(RESULTS_FOLDER, index=index) as cache:
+                self.assertEqual((10, 1), cache._cache.totals())
+            cache.erase()
+
+    def test_evict_lfu(self):
+        request.urlopen = Mock(side_effect=mock_response)
+        expiry_callback = Mock(return_value=datetime.now() + timedelta(days=1))
+        urls = ["http://www.xbmc.org/%d" % i for i in range(3)]
+        with self.urlcache.URLCache(
+            RESULTS_FOLDER, max_entries=2, eviction="lfu"
+        ) as cache:
+            for url in urls:
+                cache.get(url, expiry_callback)
+            cache._cache[urls[0]] = dict(cache._cache[urls[0]], uses=5)
+            cache._cache[urls[1]] = dict(cache._cache[urls[1]], uses=1)
+            cache._cache[urls[2]] = dict(cache._cache[urls[2]], uses=3)
+        with self.urlcache.URLCache(RESULTS_FOLDER) as cache:
+            self.assertEqual({urls[0], urls[2]}, set(cache._cache))
+
+    def test_get_streamed(self):
+        url = "http://www.xbmc.org/"
+        body = b"0123456789" * 10
+        request.urlopen = Mock(side_effect=lambda x: MockResponse(body))
+        expiry_callback = Mock(return_value=datetime.now() + timedelta(days=1))
+        with self.urlcache.URLCache(RESULTS_FOLDER, checksum="sha256") as cache:
+            cache.CHUNK_SIZE = 16
+            filename = cache.get(url, expiry_callback)
+            with open(filename, "rb") as fh:
+                self.assertEqual(body, fh.read())
+            entry = cache._cache[url]
+            self.assertEqual(100, entry["size"])
+            self.assertEqual(hashlib.sha256(body).hexdigest(), entry["sha256"])
+
+        with self.urlcache.URLCache(RESULTS_FOLDER, max_size=50) as cache:
+            cache.remove(url)
+            files = os.listdir(cache._folder)
+            with self.assertRaises(self.urlcache.DownloadTooLargeError):
+                cache.get(url, expiry_callback)
+            self.assertEqual(files, os.listdir(cache._folder))
+
+            # The declared length is checked before anything is read.
+            request.urlopen = Mock(
+                return_value=MockResponse(b"", {"Content-Length": "51"})
+            )
+            with self.assertRaises(self.urlcache.DownloadTooLargeError):
+                cache.get(url, expiry_callback)
+
+    def test_get_content_encoding(self):
+        url = "http://www.xbmc.org/"
+        body = b'{"a": "' + b"x" * 1000 + b'"}'
+        expiry_callback = Mock(return_value=datetime.now() + timedelta(days=1))
+        deflated = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        for encoding, encoded in (
+            ("gzip", gzip.compress(body)),
+            ("deflate", zlib.compress(body)),
+            ("deflate", deflated.compress(body) + deflated.flush()),
+        ):
+            request.urlopen = Mock(
+                return_value=MockResponse(encoded, {"Content-Encoding": encoding})
+            )
+            with self.urlcache.URLCache(RESULTS_FOLDER) as cache:
+                cache.remove(url)
+                filename = cache.get(url, expiry_callback)
+                req = request.urlopen.call_args.args[0]
+                self.assertEqual("gzip, deflate", req.get_header("Accept-encoding"))
+            with open(filename, "rb") as fh:
+                self.assertEqual(body, fh.read())
+
+    def test_get_compressed(self):
+        url = "http://www.xbmc.org/"
+        body = b'{"a": "' + b"x" * 1000 + b'"}'
+        expiry_callback = Mock(return_value=datetime.now() + timedelta(days=1))
+        for compress, suffix in (("gzip", ".gz"), ("lzma", ".xz")):
+            request.urlopen = Mock(return_value=MockResponse(body))
+            with self.urlcache.URLCache(RESULTS_FOLDER, compress=compress) as cache:
+                cache.remove(url)
+                data = cache.get_json(url, expiry_callback)
+                self.assertEqual({"a": "x" * 1000}, data)
+                filename = cache.get(url, expiry_callback)
+                self.assertTrue(filename.endswith(suffix))
+                self.assertLess(os.path.getsize(filename), len(body))
+                with self.urlcache.open_resource(filename) as fh:
+                    self.assertEqual(body, fh.read())
+
+    def test_get_concurrent(self):
+        # Caches opened from several threads at once share one index.
+        shutil.rmtree(RESULTS_FOLDER)
+        urls = ["http://www.xbmc.org/%d" % i for i in range(3)]
+        request.urlopen = Mock(side_effect=mock_response)
+
+        def fetch(url):
+            with self.urlcache.URLCache(RESULTS_FOLDER, index="sqlite") as cache:
+                return cache.get(url, lambda x: datetime.now() + timedelta(hours=1))
+
+        with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+            filenames = list(executor.map(fetch, urls))
+        self.assertEqual(3, request.urlopen.call_count)
+        with self.urlcache.URLCache(RESULTS_FOLDER, index="sqlite") as cache:
+            for url, filename in zip(urls, filenames):
+                self.assertEqual(filename, cache._cache[url]["resource"])
+                self.assertTrue(os.path.isfile(filename))
+
     def tearDown(self):
         shutil.rmtree(RESULTS_FOLDER)
         super(TestURLCache, self).tearDown()
@@ -1,3 +1,7 @@
+import os
+import shutil
+import tempfile
+import time
 from datetime import datetime, timezone
 from unittest import TestCase
 from unittest.mock import Mock, patch
@@ -15,6 +19,32 @@ class TestUtilities(TestCase):
         dt = dt.replace(tzinfo=timezone.utc)
         self.assertEqual(dt, utilities.strptime(date, fmt))
 
+    def test_isoparse(self):
+        expected = datetime(2014, 2, 4, 11, tzinfo=timezone.utc)
+        self.assertEqual(expected, utilities.isoparse("2014-02-04T11:00:00Z"))
+        self.assertEqual(expected, utilities.isoparse("2014-02-04T11:00:00"))
+        self.assertEqual(expected.replace(hour=0), utilities.isoparse("2014-02-04Z"))
+
+    @patch.dict(os.environ, {"TZ": "America/New_York"})
+    def test_isoparse_timezone(self):
+        # The local timezone makes no difference.
+        self.addCleanup(time.tzset)
+        time.tzset()
+        self.assertEqual(
+            datetime(2014, 7, 4, 11, tzinfo=timezone.utc),
+            utilities.isoparse("2014-07-04T11:00:00Z"),
+        )
+
+    def test_atomic_write(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, "file.json")
+        utilities.atomic_write(path, "first")
+        utilities.atomic_write(path, "second")
+        with open(path) as fh:
+            self.assertEqual("second", fh.read())
+        self.assertEqual(["file.json"], os.listdir(folder))
+
     @patch("xbmc.log")
     def test_log(self, mock_log):
         msg = "Log message"